@@ -0,0 +1,50 @@
+"""Measure the cost of debug logging while DEBUG is disabled
+
+Run from the repository root:
+    python benchmarks/bench_logging.py
+    python -O benchmarks/bench_logging.py   # trace calls in the battle loop are compiled out
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import timeit
+from pokedatasim.loggable import Loggable
+from pokedatasim.pokemon import Pokemon
+
+N = 200000
+
+
+class Probe(Loggable):
+    pass
+
+
+def per_call(stmt, number=N, **names):
+    return min(timeit.repeat(stmt, globals=names, number=number, repeat=5)) / number
+
+
+def main():
+    logging.getLogger().setLevel(logging.INFO)
+    name, damage, newhp = 'Bulbasaur', 22, 101
+    b = Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)
+    c = Pokemon("Charmander", "Fire", "", 39, 52, 43, 60, 50, 65)
+
+    results = [
+        ('empty call', per_call('f()', f=lambda: None)),
+        ('disabled dbg, lazy args', per_call("p.dbg('%s takes %s hp reduced to %s', name, damage, newhp)",
+                                             p=Probe, name=name, damage=damage, newhp=newhp)),
+        ('disabled dbg, eager concatenation',
+         per_call("p.dbg(name + ' takes ' + str(damage) + ' hp reduced to ' + str(newhp))",
+                  p=Probe, name=name, damage=damage, newhp=newhp)),
+        ('calculate_damage', per_call('b.calculate_damage(c)', number=N // 10, b=b, c=c)),
+        ('calculate_stat', per_call("P.calculate_stat(45, statname='hp')", P=Pokemon)),
+    ]
+    print('__debug__ = ' + str(__debug__))
+    for label, seconds in results:
+        print('{:40s}{:10.1f} ns/call'.format(label, seconds * 1e9))
+
+
+if __name__ == '__main__':
+    main()
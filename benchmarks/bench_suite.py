@@ -0,0 +1,250 @@
+"""Throughput of the battle mechanics, case setup, result saving and whole simulations
+
+Run from the repository root:
+    python benchmarks/bench_suite.py                          # run every benchmark and print a table
+    python benchmarks/bench_suite.py fight_3v3 setup_case     # only some of them, --list shows all names
+    python benchmarks/bench_suite.py --save baseline.json     # also store the results as a baseline
+    python benchmarks/bench_suite.py --compare baseline.json  # flag benchmarks slower than the baseline
+
+Every benchmark reports the latency of one operation (a call, a battle, a case) and operations per second.
+With --compare, a benchmark more than --threshold (a fraction, 0.1 by default) slower than in the baseline
+counts as a regression, and the script exits with status 1 if there are any. Timings depend on the machine,
+so only compare runs from the same box, with the same python flags (-O removes the trace calls).
+Nothing is downloaded: the simulations use the bundled pokemon table and results go to a temporary directory.
+The end to end benchmarks run the simulations of case_orig166_1v1.py and case_vcb_3v3.py, their tinydb
+saving is measured separately by save_tinydb.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import itertools
+import json
+import logging
+import platform
+import tempfile
+import timeit
+from datetime import datetime, timezone
+import numpy as np
+from bench_logging import Probe
+from pokedatasim.pokemon import Pokemon
+from pokedatasim.trainer import Trainer
+from pokedatasim.bigfullfactorial import BigFullFactorial
+from pokedatasim.resultsink import JsonLinesSink
+from pokedatasim.simulation import FullFactPokeDataSim
+from pokedatasim.dataload import load_pokemon
+
+# positions in pokemon.csv of the teams fought by the fight benchmarks
+TEAM1 = [2, 6, 11, 30, 71, 105]
+TEAM2 = [3, 7, 12, 25, 94, 149]
+
+# name -> (function(tmp) returning the callable to time and the number of operations per call, unit)
+BENCHMARKS = {}
+
+
+def benchmark(unit):
+    def register(function):
+        BENCHMARKS[function.__name__] = (function, unit)
+        return function
+    return register
+
+
+@benchmark('calls')
+def calculate_damage(tmp):
+    b = Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)
+    c = Pokemon("Charmander", "Fire", "", 39, 52, 43, 60, 50, 65)
+    return lambda: b.calculate_damage(c), 1
+
+
+@benchmark('calls')
+def calculate_stat(tmp):
+    return lambda: Pokemon.calculate_stat(45, statname='hp'), 1
+
+
+@benchmark('calls')
+def disabled_dbg(tmp):
+    return lambda: Probe.dbg('%s takes %s hp reduced to %s', 'Bulbasaur', 22, 101), 1
+
+
+def fight(n):
+    pokegen = Pokemon.create_pokemon_generator(load_pokemon())
+    t1 = Trainer(pokegen(TEAM1[:n]))
+    t2 = Trainer(pokegen(TEAM2[:n]))
+    rng = np.random.default_rng(0)
+
+    def run():
+        t1.reset()
+        t2.reset()
+        t1.fight(t2, rng)
+    return run, 1
+
+
+@benchmark('battles')
+def fight_1v1(tmp):
+    return fight(1)
+
+
+@benchmark('battles')
+def fight_3v3(tmp):
+    return fight(3)
+
+
+@benchmark('battles')
+def fight_6v6(tmp):
+    return fight(6)
+
+
+@benchmark('cases')
+def setup_case(tmp):
+    sim = FullFactPokeDataSim(range(30), n_pokemon_team=3)
+    cases = itertools.cycle(int(i) for i in np.random.default_rng(0).integers(len(sim.idxrange), size=1000))
+    return lambda: sim.setup_case(next(cases)), 1
+
+
+def factorial_cases():
+    bff = BigFullFactorial([166] * 6)
+    indices = [int(i) for i in np.random.default_rng(0).integers(bff.ncases, size=1000)]
+    return bff, indices
+
+
+@benchmark('cases')
+def factorial_decode(tmp):
+    bff, indices = factorial_cases()
+    indices = itertools.cycle(indices)
+    return lambda: bff.get_case_from_index(next(indices)), 1
+
+
+@benchmark('cases')
+def factorial_encode(tmp):
+    bff, indices = factorial_cases()
+    cases = itertools.cycle([bff.get_case_from_index(i) for i in indices])
+    return lambda: bff.get_index_from_case(next(cases)), 1
+
+
+def simulated(indices, n_pokemon_team=1):
+    sim = FullFactPokeDataSim(indices, n_pokemon_team=n_pokemon_team)
+    sim.run_simulation()
+    return sim
+
+
+@benchmark('results')
+def save_jsonlines(tmp):
+    results = simulated(range(30)).results
+    sink = JsonLinesSink(os.path.join(tmp, 'results.jsonl'))
+
+    def run():
+        sink.open()
+        for result in results:
+            sink.write(result)
+        sink.close()
+    return run, len(results)
+
+
+@benchmark('results')
+def save_tinydb(tmp):
+    sim = simulated([2, 6, 11], n_pokemon_team=3)
+    return lambda: sim.save_results_to_tinydb(os.path.join(tmp, 'PokeDataSim.json')), len(sim.results)
+
+
+@benchmark('cases')
+def orig166_1v1(tmp):
+    n = len(FullFactPokeDataSim(range(166)).idxrange)
+    return lambda: simulated(range(166)), n
+
+
+@benchmark('cases')
+def vcb_3v3(tmp):
+    n = len(FullFactPokeDataSim([2, 6, 11], n_pokemon_team=3).idxrange)
+    return lambda: simulated([2, 6, 11], n_pokemon_team=3), n
+
+
+def measure(function, ops, repeat=5):
+    """Best time per operation out of repeat timings, each long enough (0.2s) to be accurate"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / (number * ops)
+
+
+def run(names, repeat=5):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            function, unit = BENCHMARKS[name]
+            seconds = measure(*function(tmp), repeat=repeat)
+            results[name] = {'unit': unit, 'seconds_per_op': seconds, 'ops_per_second': 1 / seconds}
+            print(format_result(name, results[name]), flush=True)
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """Ratio of the time per operation to the baseline's for every benchmark in both, and the names of the
+    ones that got slower by more than threshold"""
+    ratios = {name: result['seconds_per_op'] / baseline['results'][name]['seconds_per_op']
+              for name, result in results.items() if name in baseline['results']}
+    return ratios, [name for name, ratio in ratios.items() if ratio > 1 + threshold]
+
+
+def format_time(seconds):
+    for scale, unit in [(1, 's'), (1e-3, 'ms'), (1e-6, 'us')]:
+        if seconds >= scale:
+            return '{:8.2f} {:2s}'.format(seconds / scale, unit)
+    return '{:8.1f} ns'.format(seconds * 1e9)
+
+
+def format_result(name, result, ratio=None):
+    line = '{:20s}{}/op {:14,.0f} {}/s'.format(name, format_time(result['seconds_per_op']),
+                                              result['ops_per_second'], result['unit'])
+    if ratio is not None:
+        line = '{:64s}{:+7.1%}'.format(line, ratio - 1)
+    return line
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per benchmark, the best one counts')
+    parser.add_argument('--save', metavar='JSON', help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare the results to a baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown relative to the baseline that counts as a regression')
+    args = parser.parse_args(args)
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks: ' + ', '.join(unknown))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('debug') != __debug__:
+            print('warning: the baseline was run with __debug__ = ' + str(baseline.get('debug')))
+
+    logging.getLogger().setLevel(logging.INFO)
+    print('__debug__ = ' + str(__debug__))
+    results = run(args.names or list(BENCHMARKS), args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': datetime.now(timezone.utc).isoformat(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'machine': platform.platform(), 'debug': __debug__,
+                       'results': results}, f, indent=2)
+    if baseline is None:
+        return 0
+    ratios, regressions = compare(results, baseline, args.threshold)
+    print('\ncompared to ' + args.compare + ' (' + baseline.get('created', '') + ')')
+    for name, result in results.items():
+        mark = '  REGRESSION' if name in regressions else ('' if name in ratios else '  not in baseline')
+        print(format_result(name, result, ratios.get(name)) + mark)
+    if regressions:
+        print(str(len(regressions)) + ' regressions beyond ' + '{:.0%}'.format(args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,28 @@
-import requests
-from bs4 import BeautifulSoup
-from pokedatasim.dataload import load_pokemon_table_from_db
-from pokedatasim.pokemon import Pokemon
-from pokedatasim.trainer import Trainer
-from tinydb import TinyDB
+"""Crawl the trainer lists on bulbapedia's trainer class pages into the trainers table of PokeDataSim.json
 
-tdb = TinyDB('PokeDataSim.json')
-tdb.purge_table('trainer')
-tdb_trainers = tdb.table('trainers')
+Pages are fetched by a pool of threads, at most --workers at a time, and kept in an on-disk cache keyed by
+URL, so running the crawler again only parses. With --offline nothing is fetched and pages missing from the
+cache are skipped, e.g. to re-parse everything, or to run against a directory of fixture pages. --base-url
+points the crawler at a stand-in server instead of bulbapedia.
 
-poketable = load_pokemon_table_from_db()
+Run from the repository root:
+    python bulbacrawler/TrainerSpider.py
+    python bulbacrawler/TrainerSpider.py --offline
+"""
+import os
+import sys
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def strsearchfcngen(string):
-    return lambda s: string in s if isinstance(s, str) else False
+import argparse
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tinydb import TinyDB
+from pokedatasim.dataload import load_pokemon, cache_dir, atomic_write
+from pokedatasim.loggable import Loggable
+from pokedatasim.pokemon import Pokemon
+from pokedatasim.trainer import Trainer
 
 bulbapedia = "http://bulbapedia.bulbagarden.net"
 
@@ -21,28 +30,99 @@ page1url = "/wiki/Category:Trainer_classes"
 page2url = "/w/index.php?title=Category:Trainer_classes&" + \
                       "pagefrom=Pokémon+Center+Lady+%28Trainer+class%29#mw-pages"
 
-tcpage1 = requests.get(bulbapedia + page1url)
-tcpage2 = requests.get(bulbapedia + page2url)
+tcstr = '(Trainer class)'
 
-soup1 = BeautifulSoup(tcpage1.content, 'html.parser')
-soup2 = BeautifulSoup(tcpage2.content, 'html.parser')
 
-tcstr = '(Trainer class)'
+def strsearchfcngen(string):
+    return lambda s: string in s if isinstance(s, str) else False
+
+
+def write_bytes(fname, content):
+    with open(fname, 'wb') as f:
+        f.write(content)
+
+
+class PageCache(Loggable):
+    """Pages stored in a directory by URL, under the sha1 of the URL, with the URL itself in a .url file next to it"""
 
-trainerclasslinks = soup1.find_all('a', title=strsearchfcngen(tcstr)) \
-                    + soup2.find_all('a', title=strsearchfcngen(tcstr))
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
 
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest())
 
-trainerclasspageurls = []
-for link in trainerclasslinks:
-    trainerclasspageurls.append(link['href'])
+    def get(self, url):
+        """Content of a cached page, None if it is not cached"""
+        try:
+            with open(self.path(url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
 
-#trainerclasspageurls = trainerclasspageurls[0:2]
+    def put(self, url, content):
+        path = self.path(url)
+        with open(path + '.url', 'w') as f:
+            f.write(url)
+        atomic_write(path, lambda tmp: write_bytes(tmp, content))
 
-trainers = []
 
-for url in trainerclasspageurls:
-    soup = BeautifulSoup(requests.get(bulbapedia + url).content, 'html.parser')
+class Fetcher(Loggable):
+    """Fetches pages through a PageCache, with up to workers requests in flight"""
+
+    def __init__(self, cache, workers=8, offline=False, timeout=30):
+        self.cache = cache
+        self.workers = workers
+        self.offline = offline
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def session(self):
+        # a session per thread keeps connections open between requests, requests is only needed when fetching
+        if not hasattr(self.local, 'session'):
+            import requests
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def fetch(self, url):
+        """Content of the page at url, from the cache if it is there, None if it cannot be had"""
+        content = self.cache.get(url)
+        if content is not None or self.offline:
+            if content is None:
+                self.info('%s is not cached', url)
+            return content
+        try:
+            response = self.session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except Exception as e:
+            self.info('failed to fetch %s: %s', url, e)
+            return None
+        self.cache.put(url, response.content)
+        return response.content
+
+    def fetch_all(self, urls):
+        """Contents of the pages at urls, in the same order"""
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(self.fetch, urls))
+
+
+def trainer_class_urls(index_pages):
+    """Links to the trainer class pages listed on the trainer class category pages"""
+    # like requests for Fetcher, bs4 is only needed for parsing
+    from bs4 import BeautifulSoup
+    urls = []
+    for content in index_pages:
+        soup = BeautifulSoup(content, 'html.parser')
+        for link in soup.find_all('a', title=strsearchfcngen(tcstr)):
+            urls.append(link['href'])
+    return urls
+
+
+def parse_trainers(content, poketable):
+    """Trainers listed on a trainer class page, with their pokemon at the listed levels (50 if there is none)"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    trainers = []
     if soup.find_all('h2', string=lambda s: strsearchfcngen('Trainer List')(s) or strsearchfcngen('Trainer list')(s)):
         attrs = {'align': 'center'}
         tables = soup.find_all('table', attrs=attrs)
@@ -69,5 +149,46 @@ for url in trainerclasspageurls:
                         except ValueError:
                             level = 50
                         pokelist += Pokemon.from_data_frame(poketable.loc[poketable.name == pokenamestr], level=level)
-                print(trainername)
-                tdb_trainers.insert(Trainer(pokelist, trainername).to_dict())
+                trainers.append(Trainer(pokelist, trainername))
+    return trainers
+
+
+def crawl(fetcher, base_url=bulbapedia, poketable=None):
+    """Fetch the trainer class pages and return the trainers listed on them"""
+    if poketable is None:
+        poketable = load_pokemon()
+    index_pages = [page for page in fetcher.fetch_all([base_url + page1url, base_url + page2url]) if page]
+    urls = [base_url + url for url in trainer_class_urls(index_pages)]
+    trainers = []
+    for url, content in zip(urls, fetcher.fetch_all(urls)):
+        if content:
+            trainers += parse_trainers(content, poketable)
+    fetcher.info('%s trainers on %s trainer class pages', len(trainers), len(urls))
+    return trainers
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='PokeDataSim.json', help='TinyDB file to store the trainers in')
+    parser.add_argument('--cache', help='page cache directory, bulbapedia in the pokedatasim cache by default')
+    parser.add_argument('--workers', type=int, default=8, help='pages fetched at the same time')
+    parser.add_argument('--offline', action='store_true', help='only use cached pages')
+    parser.add_argument('--base-url', default=bulbapedia, help='site to crawl')
+    args = parser.parse_args(args)
+    if args.cache is None:
+        args.cache = os.path.join(cache_dir(), 'bulbapedia')
+
+    fetcher = Fetcher(PageCache(args.cache), workers=args.workers, offline=args.offline)
+    trainers = crawl(fetcher, args.base_url)
+    if not trainers:
+        # e.g. offline with an empty cache, the trainers crawled before are worth more than nothing
+        fetcher.info('no trainers found, %s is left as it is', args.db)
+        return
+    tdb = TinyDB(args.db)
+    tdb.purge_table('trainers')
+    tdb.table('trainers').insert_multiple(t.to_dict() for t in trainers)
+    tdb.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from pokedatasim.loggable import Loggable
+from pokedatasim.pokemonarrays import *
+
+
+class BattleBatch(Loggable):
+    """Many trainer vs trainer battles advanced in lockstep
+
+    Each battle is one row of the arrays: hp1/hp2 hold the hp of both teams, active1/active2 the index of each
+    trainer's active pokemon (-1 once a trainer has no conscious pokemon left). The damage every pokemon does
+    to every opponent is computed up front, so a turn is a handful of masked array operations over the
+    battles that are still going. Teams of different sizes are padded with knocked out pokemon.
+    """
+
+    def __init__(self, team1, team2, hp1, hp2, active1=None, active2=None):
+        """ Construct a batch of battles
+
+        Keyword arguments:
+        team1 -- PokemonArrays with shape (number of battles, team size) for the initiating trainers
+        team2 -- PokemonArrays with the same layout for their opponents
+        hp1, hp2 -- current hp of every team member
+        active1, active2 -- index of each trainer's active pokemon, the first one by default
+        """
+        self.precompute(team1.take(np.s_[:, :, None]), team2.take(np.s_[:, None, :]),
+                        team2.take(np.s_[:, :, None]), team1.take(np.s_[:, None, :]))
+        self.speed1 = team1.speed
+        self.speed2 = team2.speed
+        self.hp1 = np.array(hp1, dtype=np.int64)
+        self.hp2 = np.array(hp2, dtype=np.int64)
+        nbattles = len(self.hp1)
+        self.active1 = np.zeros(nbattles, dtype=np.int64) if active1 is None else np.array(active1, dtype=np.int64)
+        self.active2 = np.zeros(nbattles, dtype=np.int64) if active2 is None else np.array(active2, dtype=np.int64)
+        self.turns = np.zeros(nbattles, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.hp1)
+
+    def precompute(self, attacker1, defender2, attacker2, defender1):
+        """Compute what turn_damage needs
+        from both teams' arrays, shaped to broadcast to (battle, attacker, defender)"""
+        self.damage12 = attacker1.damage(defender2)
+        self.damage21 = attacker2.damage(defender1)
+
+    @staticmethod
+    def team_arrays(trainers):
+        """Stack the pokemon of a list of trainers into (number of trainers, largest team) arrays
+        returns the PokemonArrays, the current hp and the active pokemon index of each trainer"""
+        size = max(len(t.pokemon) for t in trainers)
+        padding = [1] * len(PokemonArrays.fields)
+        stats = [[[getattr(p, f) for f in PokemonArrays.fields] for p in t.pokemon] +
+                 [padding] * (size - len(t.pokemon)) for t in trainers]
+        types = [[p.defense_codes for p in t.pokemon] + [(Pokemon.noType, Pokemon.noType)] * (size - len(t.pokemon))
+                 for t in trainers]
+        hp = [[p.hp for p in t.pokemon] + [0] * (size - len(t.pokemon)) for t in trainers]
+        stats = np.array(stats, dtype=np.int64)
+        arrays = PokemonArrays(*[stats[:, :, i] for i in range(len(PokemonArrays.fields))], types)
+        return arrays, hp, [t.active_pokemon_idx for t in trainers]
+
+    @classmethod
+    def from_trainers(cls, trainers1, trainers2):
+        """Set up the battles trainers1[i] vs trainers2[i] from the trainers' current state"""
+        team1, hp1, active1 = cls.team_arrays(trainers1)
+        team2, hp2, active2 = cls.team_arrays(trainers2)
+        return cls(team1, team2, hp1, hp2, active1, active2)
+
+    def live(self):
+        """Mask of the battles in which both trainers still have an active pokemon"""
+        return (self.active1 >= 0) & (self.active2 >= 0)
+
+    @staticmethod
+    def choose_next_pokemon(hp):
+        """Index of the first conscious pokemon in each row of hp, -1 if there is none"""
+        conscious = hp > 0
+        return np.where(conscious.any(axis=1), conscious.argmax(axis=1), -1)
+
+    def turn_damage(self, rows, active1, active2, rng):
+        """Damage the active pokemon of the battles in rows do to each other this turn"""
+        return self.damage12[rows, active1, active2], self.damage21[rows, active2, active1]
+
+    def take_turn(self, rows, tiebreak, rng=None):
+        """Process one turn of the battles in rows, see Trainer.take_turn
+        tiebreak holds a uniform random number per row, used when the active pokemon have the same speed,
+        rng is passed on to turn_damage"""
+        active1 = self.active1[rows]
+        active2 = self.active2[rows]
+        speed1 = self.speed1[rows, active1]
+        speed2 = self.speed2[rows, active2]
+        t1first = (speed1 > speed2) | ((speed1 == speed2) & (tiebreak <= 0.5))
+        damage12, damage21 = self.turn_damage(rows, active1, active2, rng)
+        hp1 = self.hp1[rows, active1]
+        hp2 = self.hp2[rows, active2]
+
+        # Trainer.take_turn checks the non-initiating trainer's active pokemon for a knockout after the first attack
+        # and the initiating trainer's after the second one, whichever of them attacked
+        hp1 = np.where(t1first, hp1, np.maximum(0, hp1 - damage21))
+        hp2 = np.where(t1first, np.maximum(0, hp2 - damage12), hp2)
+        t2ko = hp2 == 0
+        second = ~t2ko
+        hp1 = np.where(second & t1first, np.maximum(0, hp1 - damage21), hp1)
+        hp2 = np.where(second & ~t1first, np.maximum(0, hp2 - damage12), hp2)
+        t1ko = second & (hp1 == 0)
+
+        self.hp1[rows, active1] = hp1
+        self.hp2[rows, active2] = hp2
+        self.active2[rows[t2ko]] = self.choose_next_pokemon(self.hp2[rows[t2ko]])
+        self.active1[rows[t1ko]] = self.choose_next_pokemon(self.hp1[rows[t1ko]])
+        self.turns[rows] += 1
+
+    def fight(self, rng=np.random):
+        """Take turns until every battle is over, rng breaks speed ties
+        Returns a boolean array, True where the initiating trainer won"""
+        live = self.live()
+        while live.any():
+            rows = np.flatnonzero(live)
+            self.take_turn(rows, rng.random(len(rows)), rng)
+            live = self.live()
+        if __debug__:
+            self.dbg('%s battles in %s turns', len(self), self.turns.max(initial=0))
+        return self.active1 >= 0
+
+    def apply(self, idx, t1, t2):
+        """Copy the state of battle idx back to its trainers and their pokemon"""
+        for hp, active, trainer in [(self.hp1, self.active1, t1), (self.hp2, self.active2, t2)]:
+            for i, p in enumerate(trainer.pokemon):
+                p.hp = int(hp[idx, i])
+            trainer.active_pokemon_idx = int(active[idx])
+        t1.turns += int(self.turns[idx])
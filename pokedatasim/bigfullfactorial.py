@@ -3,36 +3,86 @@ import numpy as np
 
 
 class BigFullFactorial(Loggable):
-    """Class to define a full factorial experimental design with too many cases for storing them as a data frame"""
+    """Class to define a full factorial experimental design with too many cases for storing them as a data frame
+
+    Indices and strides are python integers, so designs with more than 2**63 cases are indexed exactly.
+    The batch methods work on numpy arrays: int64 arrays when the design fits in int64, object arrays of
+    python integers otherwise.
+    """
 
     def __init__(self, levels):
-        self.levels = levels
-        ncases = np.prod(levels)
+        self.levels = [int(level) for level in levels]
+        # strides[i] is the number of cases between consecutive levels of factor i
+        self.strides = [1] * len(self.levels)
+        for i in range(len(self.levels) - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * self.levels[i + 1]
+        ncases = self.strides[0] * self.levels[0] if self.levels else 1
+        self.ncases = ncases
+        self.fits_int64 = ncases <= np.iinfo(np.int64).max
         self.idxrange = range(ncases)
-        self.dbg('levels: ' + str(levels) + ' -- number of cases: ' + str(ncases))
+        self.dbg('levels: %s -- number of cases: %s', levels, ncases)
 
     def get_case_from_index(self, idx):
         """Method for defining cases based on an index
         like a de-hash function"""
-        if idx not in self.idxrange:
+        if not 0 <= idx < self.ncases:
             return None
-        remainder = idx
+        remainder = int(idx)
         case = []
-        for i in range(len(self.levels)):
-            divisor = np.prod(self.levels[i:]) / self.levels[i]
-            case.append(int(remainder // divisor))
-            remainder %= divisor
-        self.dbg('index: ' + str(idx) + ' -- case: ' + str(case))
+        for stride in self.strides:
+            level, remainder = divmod(remainder, stride)
+            case.append(level)
+        if __debug__:
+            self.dbg('index: %s -- case: %s', idx, case)
         return case
 
     def get_index_from_case(self, case):
         """Method for defining an index for a given case
         like a hash function"""
         result_idx = 0
-        for idx in range(len(case)):
-            if case[idx] not in range(self.levels[idx]):
+        for level, nlevels, stride in zip(case, self.levels, self.strides):
+            if not 0 <= level < nlevels:
                 return None
-            result_idx += case[idx] * np.prod(self.levels[idx:]) / self.levels[idx]
-        result_idx = int(result_idx)
-        self.dbg('case: ' + str(case) + ' -- index: ' + str(result_idx))
+            result_idx += int(level) * stride
+        if __debug__:
+            self.dbg('case: %s -- index: %s', case, result_idx)
         return result_idx
+
+    def get_cases_from_indices(self, indices):
+        """Decode an array of indices at once, returns an array with one case per row
+        indices must be valid"""
+        if self.fits_int64:
+            return np.stack(np.unravel_index(np.asarray(indices, dtype=np.int64), self.levels), axis=-1)
+        remainder = np.array([int(i) for i in np.ravel(indices)], dtype=object)
+        cases = np.empty((len(remainder), len(self.levels)), dtype=object)
+        for i, stride in enumerate(self.strides):
+            cases[:, i] = remainder // stride
+            remainder = remainder % stride
+        return cases
+
+    def get_indices_from_cases(self, cases):
+        """Encode an array with one case per row at once, returns an array of indices
+        cases must be valid"""
+        if self.fits_int64:
+            cases = np.asarray(cases, dtype=np.int64)
+            return np.ravel_multi_index(tuple(cases.T), self.levels)
+        indices = np.zeros(len(cases), dtype=object)
+        for i, stride in enumerate(self.strides):
+            indices += np.array([int(level) for level in np.asarray(cases)[:, i]], dtype=object) * stride
+        return indices
+
+    def iter_case_blocks(self, blocksize, idxrange=None):
+        """Iterate over the cases of idxrange (a range of consecutive indices, all cases by default)
+        in blocks of at most blocksize cases
+        yields arrays of indices and the matching arrays of cases"""
+        if idxrange is None:
+            idxrange = self.idxrange
+        start = idxrange.start
+        while start < idxrange.stop:
+            stop = min(start + blocksize, idxrange.stop)
+            if self.fits_int64:
+                indices = np.arange(start, stop, dtype=np.int64)
+            else:
+                indices = np.array(range(start, stop), dtype=object)
+            yield indices, self.get_cases_from_indices(indices)
+            start = stop
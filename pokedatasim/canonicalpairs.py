@@ -0,0 +1,51 @@
+from pokedatasim.loggable import Loggable
+from math import isqrt
+
+
+class CanonicalPairs(Loggable):
+    """Class to enumerate the unordered pairs of distinct items, each pair once as [i, j] with i < j
+
+    Pairs are numbered in lexicographic order, which is the order in which a full factorial over two factors
+    visits them, so iterating over idxrange gives the same sequence as skipping mirrored and repeated cases
+    of the full factorial without decoding any of the skipped ones.
+    """
+
+    def __init__(self, nitems):
+        self.nitems = nitems
+        ncases = nitems * (nitems - 1) // 2
+        self.ncases = ncases
+        self.idxrange = range(ncases)
+        self.dbg('items: %s -- number of cases: %s', nitems, ncases)
+
+    def first_index(self, i):
+        """Index of the first pair [i, i + 1] starting with item i"""
+        return i * (2 * self.nitems - i - 1) // 2
+
+    def get_case_from_index(self, idx):
+        """Method for defining cases based on an index
+        like a de-hash function"""
+        if not 0 <= idx < self.ncases:
+            return None
+        idx = int(idx)
+        # first_index is quadratic in i, solve it for the last first index not after idx and correct rounding
+        b = 2 * self.nitems - 1
+        i = (b - isqrt(b * b - 8 * idx)) // 2
+        while self.first_index(i) > idx:
+            i -= 1
+        while self.first_index(i + 1) <= idx:
+            i += 1
+        case = [i, idx - self.first_index(i) + i + 1]
+        if __debug__:
+            self.dbg('index: %s -- case: %s', idx, case)
+        return case
+
+    def get_index_from_case(self, case):
+        """Method for defining an index for a given case
+        like a hash function, returns None unless case is [i, j] with i < j"""
+        i, j = case
+        if not 0 <= i < j < self.nitems:
+            return None
+        result_idx = self.first_index(i) + j - i - 1
+        if __debug__:
+            self.dbg('case: %s -- index: %s', case, result_idx)
+        return result_idx
@@ -1,16 +1,139 @@
-import pandas as pd
+import numpy as np
+import hashlib
 import os
+import threading
 # import sqlite3
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# parsed data files by content digest, so every file is parsed at most once per process
+loaded = {}
 
-def load_type_modifier_table(fname=dir_path+'/type-modifier-table.csv'):
-    return pd.DataFrame.from_csv(fname)
 
+def file_digest(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-def load_pokemon(fname=dir_path+'/pokemon.csv'):
-    return pd.DataFrame.from_csv(fname, index_col=None)
+
+def atomic_write(path, writer):
+    """Write path by calling writer with the name of a temporary file next to it, which is then renamed to path
+    the temporary name is unique to the process and thread, so concurrent writers do not mix their output,
+    readers never see a partial file and a writer that is interrupted leaves the previous file in place"""
+    tmp = path + '.' + str(os.getpid()) + '-' + str(threading.get_ident()) + '.tmp'
+    try:
+        writer(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_cached(fname, kind, parse, save, load, use_cache=True):
+    """Load fname with parse() the first time, later from memory or from the binary copy in cache_dir()
+    the copy is named after kind and the digest of fname's contents, so edits to the file are picked up"""
+    key = (kind, file_digest(fname))
+    if key in loaded:
+        return loaded[key]
+    cached = os.path.join(cache_dir(), kind + '-' + key[1]) if use_cache else None
+    if cached and os.path.exists(cached):
+        data = load(cached)
+    else:
+        data = parse(fname)
+        if cached:
+            atomic_write(cached, lambda tmp: save(tmp, data))
+    loaded[key] = data
+    return data
+
+
+def read_table(fname, index_col=None):
+    import pandas as pd
+    return pd.read_csv(fname, index_col=index_col)
+
+
+def pandas_cache_kind(name):
+    # pickles are only read back by the pandas version that wrote them
+    import pandas as pd
+    return name + '-pandas' + pd.__version__
+
+
+def save_pickle(fname, table):
+    table.to_pickle(fname)
+
+
+def read_pickle(fname):
+    import pandas as pd
+    return pd.read_pickle(fname)
+
+
+def load_type_modifier_table(fname=dir_path+'/type-modifier-table.csv', use_cache=True):
+    return load_cached(fname, pandas_cache_kind('typetable'), lambda f: read_table(f, index_col=0),
+                       save_pickle, read_pickle, use_cache).copy()
+
+
+def load_pokemon(fname=dir_path+'/pokemon.csv', use_cache=True):
+    return load_cached(fname, pandas_cache_kind('pokemon'), read_table, save_pickle, read_pickle, use_cache).copy()
+
+
+def build_type_multiplier(type_modifier_table):
+    """Encode a type modifier table as a dense array indexed by integer type codes
+    returns the type names (a type's code is its position in this list) and an array where
+    multiplier[attack, defense1, defense2] is the modifier of an attack type against a dual type defender.
+    Code len(names) stands for 'no type': single type defenders use it for defense2"""
+    names = list(type_modifier_table.index)
+    ntypes = len(names)
+    single = np.ones((ntypes + 1, ntypes + 1))
+    single[:ntypes, :ntypes] = type_modifier_table.loc[names, names].values
+    multiplier = single[:, :, None] * single[:, None, :]
+    return names, multiplier
+
+
+def save_type_multiplier(fname, data):
+    names, multiplier = data
+    with open(fname, 'wb') as f:
+        np.savez(f, names=np.array(names), multiplier=multiplier)
+
+
+def read_type_multiplier(fname):
+    with np.load(fname) as data:
+        return data['names'].tolist(), data['multiplier']
+
+
+def load_type_multiplier(fname=dir_path+'/type-modifier-table.csv', use_cache=True):
+    """build_type_multiplier of the type modifier table, cached without pandas so it loads in a millisecond
+    the returned array is shared and read-only"""
+    names, multiplier = load_cached(fname, 'typemultiplier.npz',
+                                    lambda f: build_type_multiplier(load_type_modifier_table(f, use_cache)),
+                                    save_type_multiplier, read_type_multiplier, use_cache)
+    multiplier.setflags(write=False)
+    return names, multiplier
+
+
+class LoadOnAccess:
+    """Class attribute computed by function(cls) the first time it is read
+
+    The value then replaces this descriptor on the class that defines it, so later reads are plain attribute
+    lookups. Used to put off loading data files until they are needed.
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        value = self.function(self.owner)
+        setattr(self.owner, self.name, value)
+        return value
+
+
+def cache_dir():
+    """Directory for derived data that is cached between runs, set POKEDATASIM_CACHE to override it"""
+    path = os.environ.get('POKEDATASIM_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pokedatasim'))
+    os.makedirs(path, exist_ok=True)
+    return path
 
 
 # def load_type_modifier_table_from_db(dbfname="pokedex.sqlite"):
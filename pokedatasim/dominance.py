@@ -0,0 +1,53 @@
+from pokedatasim.pokemonarrays import *
+
+
+class DominanceIndex(Loggable):
+    """For every pokemon, the pokemon it is deterministically inferior to (see Pokemon.deterministically_inferior_to)
+
+    Pokemon are grouped by their set of types, and within a group all pairs are compared at once, so building
+    the index takes a few array operations per type combination. Positions are those of the PokemonArrays the
+    index is built from. A pokemon only counts as inferior to one of at least its level, as the attacker's
+    level is part of the damage.
+
+    In a 1v1 battle the dominating pokemon is faster, needs no more attacks than its opponent (it has more hp
+    and with the same types deals at least as much damage) and therefore always wins, see resolve_duels.
+    """
+    stats = ['maxhp', 'attack', 'defense', 'spatk', 'spdef', 'speed']
+
+    def __init__(self, arrays):
+        stats = np.stack([getattr(arrays, s) for s in self.stats], axis=1)
+        typesets = np.sort(arrays.types, axis=1)
+        _, group = np.unique(typesets, axis=0, return_inverse=True)
+        group = np.ravel(group)
+        self.dominators = [np.zeros(0, dtype=np.int64)] * len(arrays)
+        self.inferior = set()
+        for members in np.split(np.argsort(group, kind='stable'), np.flatnonzero(np.diff(np.sort(group))) + 1):
+            level = arrays.level[members]
+            # inferior[k, l]: member k is inferior to member l
+            inferior = ((stats[members][:, None, :] < stats[members][None, :, :]).all(axis=2) &
+                        (level[:, None] <= level[None, :]))
+            for k, l in zip(*np.nonzero(inferior)):
+                self.inferior.add((int(members[k]), int(members[l])))
+            for k in np.flatnonzero(inferior.any(axis=1)):
+                self.dominators[members[k]] = members[inferior[k]]
+        self.dbg('%s pokemon, %s dominated pairs', len(arrays), len(self.inferior))
+
+    @classmethod
+    def from_data_frame(cls, poketable, level=0, iv=0, ev=0):
+        return cls(PokemonArrays.from_data_frame(poketable, level=level, iv=iv, ev=ev))
+
+    def __len__(self):
+        """Number of dominated pairs"""
+        return len(self.inferior)
+
+    def inferior_to(self, i, j):
+        """Whether pokemon i is deterministically inferior to pokemon j"""
+        return (i, j) in self.inferior
+
+    def outcome(self, i, j):
+        """True if pokemon i beats pokemon j by dominance, False if j beats i, None if neither dominates"""
+        if (j, i) in self.inferior:
+            return True
+        if (i, j) in self.inferior:
+            return False
+        return None
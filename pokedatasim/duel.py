@@ -0,0 +1,28 @@
+from pokedatasim.pokemonarrays import *
+
+
+def turns_to_ko(damage, maxhp):
+    """Number of attacks pokemon i needs to knock out pokemon j, for a damage matrix and the defenders' hp
+    pairs where no damage is done never end and get inf"""
+    damage = np.asarray(damage, dtype=float)
+    with np.errstate(divide='ignore'):
+        return np.ceil(np.asarray(maxhp)[None, :] / damage)
+
+
+def resolve_duels(damage, maxhp, speed):
+    """Resolve every 1v1 battle in closed form
+
+    damage[i, j] is the damage pokemon i does to pokemon j, maxhp and speed hold each pokemon's stats.
+    Returns a matrix whose entry [i, j] is the probability that i beats j. This is what Trainer.fight
+    produces: the faster pokemon wins if it needs no more attacks than its opponent, and when speeds are
+    tied the attack order is drawn every turn, so the pokemon needing fewer attacks wins and equal
+    counts are decided by a coin toss on the last turn.
+    """
+    turns = turns_to_ko(damage, maxhp)
+    speed = np.asarray(speed)
+    faster = speed[:, None] > speed[None, :]
+    slower = speed[:, None] < speed[None, :]
+    first_wins = turns <= turns.T
+    second_wins = turns < turns.T
+    return np.where(faster, first_wins, np.where(slower, second_wins, 0.5 * first_wins + 0.5 * second_wins))
+
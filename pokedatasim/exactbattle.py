@@ -0,0 +1,179 @@
+from pokedatasim.loggable import Loggable
+import numpy as np
+
+
+class ExactBattle(Loggable):
+    """Exact probability that the initiating trainer wins a battle, instead of sampling speed ties
+
+    A state is (active1, active2, hp1, hp2): the index of each trainer's active pokemon (-1 once a trainer has
+    no conscious pokemon left) and tuples of the hp of both teams. A turn is deterministic unless the active
+    pokemon have the same speed, then either one attacks first with probability 1/2 (see Trainer.take_turn).
+    The win probability of every state reached is memoized in self.memo, so states reached along several
+    branches are only resolved once. Every turn costs at least one hp, so no state is reached from itself.
+
+    play() instead fights a single battle like Trainer.fight. Both can share resolved sub-states between
+    battles through a TranspositionTable. Pokemon before the active one are knocked out, so a sub-state is
+    identified by the battle keys (see Pokemon.battle_key) and hp of each team from its active pokemon on.
+    The table is only used for states that start a new pairing of active pokemon, which is where different
+    battles meet, the turns within a pairing are cheap to replay.
+    """
+
+    def __init__(self, trainer1, trainer2, table=None):
+        """Set up the battle from the trainers' current state, table is an optional TranspositionTable"""
+        self.damage12 = [[p.calculate_damage(q) for q in trainer2.pokemon] for p in trainer1.pokemon]
+        self.damage21 = [[p.calculate_damage(q) for q in trainer1.pokemon] for p in trainer2.pokemon]
+        self.speed1 = [p.speed for p in trainer1.pokemon]
+        self.speed2 = [p.speed for p in trainer2.pokemon]
+        self.maxhp1 = [p.maxhp for p in trainer1.pokemon]
+        self.maxhp2 = [p.maxhp for p in trainer2.pokemon]
+        self.start = (trainer1.active_pokemon_idx, trainer2.active_pokemon_idx,
+                      tuple(p.hp for p in trainer1.pokemon), tuple(p.hp for p in trainer2.pokemon))
+        self.memo = {}
+        self.table = table
+        if table is not None:
+            self.keys1 = tuple(p.battle_key() for p in trainer1.pokemon)
+            self.keys2 = tuple(p.battle_key() for p in trainer2.pokemon)
+
+    def pairing_start(self, state):
+        """Whether one of the active pokemon has not been attacked yet, so state starts a new pairing"""
+        active1, active2, hp1, hp2 = state
+        return hp1[active1] == self.maxhp1[active1] or hp2[active2] == self.maxhp2[active2]
+
+    def state_key(self, state, kind):
+        """Key of the sub-state of a live state in the transposition table, kind tells apart what is stored"""
+        active1, active2, hp1, hp2 = state
+        return kind, self.keys1[active1:], hp1[active1:], self.keys2[active2:], hp2[active2:]
+
+    @staticmethod
+    def choose_next_pokemon(hp):
+        """Index of the first conscious pokemon, -1 if there is none"""
+        for idx, h in enumerate(hp):
+            if h > 0:
+                return idx
+        return -1
+
+    def turn(self, state, t1first):
+        """State after one turn, see BattleBatch.take_turn"""
+        active1, active2, hp1, hp2 = state
+        damage12 = self.damage12[active1][active2]
+        damage21 = self.damage21[active2][active1]
+        h1 = hp1[active1]
+        h2 = hp2[active2]
+        if t1first:
+            h2 = max(0, h2 - damage12)
+        else:
+            h1 = max(0, h1 - damage21)
+        t2ko = h2 == 0
+        if not t2ko:
+            if t1first:
+                h1 = max(0, h1 - damage21)
+            else:
+                h2 = max(0, h2 - damage12)
+        t1ko = not t2ko and h1 == 0
+        hp1 = hp1[:active1] + (h1,) + hp1[active1 + 1:]
+        hp2 = hp2[:active2] + (h2,) + hp2[active2 + 1:]
+        if t2ko:
+            active2 = self.choose_next_pokemon(hp2)
+        if t1ko:
+            active1 = self.choose_next_pokemon(hp1)
+        return active1, active2, hp1, hp2
+
+    def successors(self, state):
+        """List of (probability, state) after one turn"""
+        speed1 = self.speed1[state[0]]
+        speed2 = self.speed2[state[1]]
+        if speed1 != speed2:
+            return [(1, self.turn(state, speed1 > speed2))]
+        return [(0.5, self.turn(state, True)), (0.5, self.turn(state, False))]
+
+    def win_probability(self, state=None):
+        """Probability that trainer1 wins from state, the starting state by default"""
+        if state is None:
+            state = self.start
+        memo = self.memo
+        stack = [state]
+        while stack:
+            current = stack[-1]
+            if current in memo:
+                stack.pop()
+                continue
+            if current[0] < 0 or current[1] < 0:
+                memo[current] = float(current[0] >= 0)
+                stack.pop()
+                continue
+            cached = self.table is not None and self.pairing_start(current)
+            if cached:
+                p = self.table.get(self.state_key(current, 'p'))
+                if p is not None:
+                    memo[current] = p
+                    stack.pop()
+                    continue
+            successors = self.successors(current)
+            unresolved = [s for p, s in successors if s not in memo]
+            if unresolved:
+                stack.extend(unresolved)
+                continue
+            memo[current] = sum(p * memo[s] for p, s in successors)
+            if cached:
+                self.table.put(self.state_key(current, 'p'), memo[current])
+            stack.pop()
+        if __debug__:
+            self.dbg('%s states resolved', len(memo))
+        return memo[state]
+
+    def play(self, rng=np.random):
+        """Fight the battle once from the starting state, drawing speed ties from rng like Trainer.fight
+        returns the final state and the number of turns
+
+        Once no more ties are drawn the rest of the battle is deterministic, so the outcome of every state
+        after the last tie is stored in the transposition table and a battle reaching a stored state skips
+        to its end. No random numbers are drawn past the last tie, so results do not depend on the table.
+        """
+        state = self.start
+        turns = 0
+        # pairing starts since the last tie with their keys and the turns taken before them
+        path = []
+        while state[0] >= 0 and state[1] >= 0:
+            speed1 = self.speed1[state[0]]
+            speed2 = self.speed2[state[1]]
+            if speed1 == speed2:
+                path = []
+                t1first = rng.random() <= 0.5
+            else:
+                if self.table is not None and self.pairing_start(state):
+                    key = self.state_key(state, 'play')
+                    outcome = self.table.get(key)
+                    if outcome is not None:
+                        state, turns = self.skip(state, turns, outcome)
+                        break
+                    path.append((key, state, turns))
+                t1first = speed1 > speed2
+            state = self.turn(state, t1first)
+            turns += 1
+        for key, visited, before in path:
+            self.table.put(key, self.outcome(visited, state, turns - before))
+        return state, turns
+
+    @staticmethod
+    def outcome(state, final, turns):
+        """What the transposition table stores for a state: the final hp and active index of each team from its
+        active pokemon on, relative to that pokemon, and the turns it took to get from state to final"""
+        offset = lambda start, end: end - start if end >= 0 else -1
+        return final[2][state[0]:], final[3][state[1]:], offset(state[0], final[0]), offset(state[1], final[1]), turns
+
+    @staticmethod
+    def skip(state, turns, outcome):
+        """Final state and turns of a battle in state after turns turns, from the outcome stored for state"""
+        active1, active2, hp1, hp2 = state
+        final1, final2, offset1, offset2, remaining = outcome
+        return ((active1 + offset1 if offset1 >= 0 else -1), (active2 + offset2 if offset2 >= 0 else -1),
+                hp1[:active1] + final1, hp2[:active2] + final2), turns + remaining
+
+    @staticmethod
+    def apply(state, turns, trainer1, trainer2):
+        """Copy a state reached after turns turns back to the trainers and their pokemon"""
+        for trainer, active, hp in [(trainer1, state[0], state[2]), (trainer2, state[1], state[3])]:
+            for p, h in zip(trainer.pokemon, hp):
+                p.hp = h
+            trainer.active_pokemon_idx = active
+        trainer1.turns += turns
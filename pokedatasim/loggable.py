@@ -1,20 +1,38 @@
 import logging
-import inspect
+import sys
 
 logging.basicConfig(level=logging.INFO)
 
+logger = logging.getLogger()
+
 
 class Loggable:
+    """Mixin providing class-tagged logging
+
+    Messages use logging's lazy %-style arguments, e.g. self.dbg('%s takes %d damage', name, damage),
+    so nothing is formatted unless the level is enabled. The level is checked before the caller's frame
+    is looked up, which keeps a disabled dbg() call down to a method call and an integer comparison.
+    Trace calls inside the battle loop are additionally wrapped in `if __debug__:` blocks, which the
+    compiler removes entirely when python is run with -O.
+    """
+    __slots__ = ()
+
     @classmethod
-    def format_msg(cls,msg):
-        return cls.__name__ + ':' + inspect.getouterframes(inspect.currentframe(), 2)[1][3] + ': ' + msg
+    def format_msg(cls, msg, depth=2):
+        """Prefix msg with the class name and the name of the function that logged it
+        depth is the number of frames between this method and that function"""
+        return cls.__name__ + ':' + sys._getframe(depth).f_code.co_name + ': ' + msg
+
+    @staticmethod
+    def debug_enabled():
+        return logger.isEnabledFor(logging.DEBUG)
 
     @classmethod
     def dbg(cls, msg='', *args, **kwargs):
-        msg = cls.format_msg(msg)
-        logging.debug(msg, *args, **kwargs)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(cls.format_msg(msg), *args, **kwargs)
 
     @classmethod
     def info(cls, msg='', *args, **kwargs):
-        msg = cls.format_msg(msg)
-        logging.info(msg, *args, **kwargs)
\ No newline at end of file
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(cls.format_msg(msg), *args, **kwargs)
@@ -0,0 +1,50 @@
+from pokedatasim.batchbattle import *
+from statistics import NormalDist
+
+
+def wilson_interval(wins, n, confidence=0.95):
+    """Wilson score confidence interval of a win probability estimated from wins out of n battles"""
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = np.asarray(wins) / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    halfwidth = z / (1 + z * z / n) * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return np.clip(center - halfwidth, 0, 1), np.clip(center + halfwidth, 0, 1)
+
+
+class RandomBattleBatch(BattleBatch):
+    """Battles with random critical hits and damage rolls, see Pokemon.calculate_damage
+
+    The power of every attacker against every defender is computed up front with and without a critical hit
+    (see PokemonArrays.power), each turn draws a critical hit and a damage roll per attack and battle.
+    """
+
+    def precompute(self, attacker1, defender2, attacker2, defender1):
+        self.power12 = [attacker1.power(defender2, critical=critical) for critical in [False, True]]
+        self.power21 = [attacker2.power(defender1, critical=critical) for critical in [False, True]]
+
+    def turn_damage(self, rows, active1, active2, rng):
+        damage = []
+        for power, attacker, defender in [(self.power12, active1, active2), (self.power21, active2, active1)]:
+            critical = rng.random(len(rows)) < Pokemon.criticalHitRate
+            z = (Pokemon.minDamageRoll + (Pokemon.maxDamageRoll - Pokemon.minDamageRoll) *
+                 rng.random(len(rows))).astype(np.int64)
+            power = np.where(critical, power[1][rows, attacker, defender], power[0][rows, attacker, defender])
+            damage.append(PokemonArrays.roll_damage(power, z))
+        return damage
+
+    @classmethod
+    def replicates(cls, trainer1, trainer2, n):
+        """n copies of the battle trainer1 vs trainer2, from the trainers' current state
+        the copies share read-only views of the precomputed powers and speeds"""
+        batch = cls.from_trainers([trainer1], [trainer2])
+        expand = lambda a: np.broadcast_to(a, (n,) + a.shape[1:])
+        batch.power12 = [expand(power) for power in batch.power12]
+        batch.power21 = [expand(power) for power in batch.power21]
+        batch.speed1 = expand(batch.speed1)
+        batch.speed2 = expand(batch.speed2)
+        batch.hp1 = np.repeat(batch.hp1, n, axis=0)
+        batch.hp2 = np.repeat(batch.hp2, n, axis=0)
+        batch.active1 = np.repeat(batch.active1, n)
+        batch.active2 = np.repeat(batch.active2, n)
+        batch.turns = np.zeros(n, dtype=np.int64)
+        return batch
@@ -1,28 +1,72 @@
 from pokedatasim.loggable import Loggable
 from pokedatasim.dataload import *
+import sys
+
+# calls of Pokemon.calculate_damage in this process, read by Telemetry. A list, so counting does not assign
+# to the Pokemon class, which would invalidate python's attribute lookup caches for it
+damage_calls = [0]
 
 
 class Pokemon(Loggable):
-    """ This class defines a Pokemon """
+    """ This class defines a Pokemon
+
+    Pokemon are kept in large numbers by the simulations, so instances have no __dict__: the attributes are
+    slots, names are interned and the type codes are tuples shared by all pokemon of the same types.
+    """
+    __slots__ = ('name', 'type_codes', 'defense_codes', 'level', 'maxhp', 'hp',
+                 'attack', 'defense', 'spatk', 'spdef', 'speed')
     standardLevel = 50
     standardAttackPower = 30
     # average from genIII up on http://bulbapedia.bulbagarden.net/wiki/Individual_values
     standardIV = 15
     # even distribution of EV across stats from http://bulbapedia.bulbagarden.net/wiki/Effort_values
     standardEV = round(510/6)
-    typeModifierTable = load_type_modifier_table()
+    # random damage, used by calculate_damage when it gets a random number source
+    criticalHitRate = .05
+    minDamageRoll = 217
+    maxDamageRoll = 255
+    averageDamageRoll = round((minDamageRoll + maxDamageRoll) / 2)
+    # the type tables are loaded the first time they are used, see LoadOnAccess
+    typeModifierTable = LoadOnAccess(lambda cls: load_type_modifier_table())
 
     specialTypes = ['Fire', 'Water', 'Grass', 'Electric', 'Ice', 'Psychic']
     physicalTypes = ['Normal', 'Fighting', 'Flying', 'Ground',
                      'Rock', 'Bug', 'Poison', 'Ghost', 'Dragon', 'Dark', 'Steel', "Fairy"]
     allTypes = set(specialTypes + physicalTypes)
 
+    # types are encoded as integer codes, see build_type_multiplier
+    typeNames = LoadOnAccess(lambda cls: load_type_multiplier()[0])
+    typeMultiplier = LoadOnAccess(lambda cls: load_type_multiplier()[1])
+    typeCodes = LoadOnAccess(lambda cls: {name: code for code, name in enumerate(cls.typeNames)})
+    noType = LoadOnAccess(lambda cls: len(cls.typeNames))
+    typeIsPhysical = LoadOnAccess(lambda cls: list(map(set(cls.physicalTypes).__contains__, cls.typeNames)) + [False])
+    # nested lists are much faster than numpy arrays for scalar lookups
+    typeMultiplierLookup = LoadOnAccess(lambda cls: cls.typeMultiplier.tolist())
+    # type names -> shared (type_codes, defense_codes)
+    typeCodeCache = {}
+
+    @property
+    def type(self):
+        """List of the names of this pokemon's types"""
+        return [self.typeNames[code] for code in self.type_codes]
+
+    @classmethod
+    def encode_types(cls, type1, type2):
+        """Type codes and defense codes (always two, padded with noType) of a pokemon with the given types"""
+        key = tuple(x for x in [type1, type2] if x in cls.allTypes)
+        codes = cls.typeCodeCache.get(key)
+        if codes is None:
+            type_codes = tuple(cls.typeCodes[x] for x in key)
+            codes = cls.typeCodeCache[key] = (type_codes, (type_codes + (cls.noType, cls.noType))[:2])
+        return codes
+
     def to_dict(self):
-        type1 = self.type[0]
-        if len(self.type) < 2:
+        type_codes = self.type_codes
+        type1 = self.typeNames[type_codes[0]]
+        if len(type_codes) < 2:
             type2 = None
         else:
-            type2 = self.type[1]
+            type2 = self.typeNames[type_codes[1]]
         return {'name': self.name, 'level': self.level, 'type1': type1, 'type2': type2, "hp": self.hp,
                 "maxhp": self.maxhp, "attack": self.attack, "defense": self.defense, "spatk": self.spatk,
                 "spdef": self.spdef, "speed": self.speed}
@@ -51,12 +95,9 @@ class Pokemon(Loggable):
         else:
             modifier = 5
         stat = int(((2 * statbase) + iv + int(ev / 4)) * level / 100 + modifier)
-        cls.dbg(statname +
-                ' -- base: ' + str(statbase) +
-                ' -- iv: ' + str(iv) +
-                ' -- ev: ' + str(ev) +
-                ' -- level: ' + str(level) +
-                ' -- result: ' + str(stat))
+        if __debug__:
+            cls.dbg('%s -- base: %s -- iv: %s -- ev: %s -- level: %s -- result: %s',
+                    statname, statbase, iv, ev, level, stat)
         return stat
 
     def __init__(self, name, type1, type2, hp,
@@ -81,8 +122,8 @@ class Pokemon(Loggable):
             iv = self.standardIV
         if ev == 0:
             ev = self.standardEV
-        self.name = name
-        self.type = [x for x in [type1, type2] if x in self.allTypes]
+        self.name = sys.intern(name) if isinstance(name, str) else name
+        self.type_codes, self.defense_codes = self.encode_types(type1, type2)
         if calcstat:
             self.maxhp = Pokemon.calculate_stat(hp, level, iv, ev, statname='hp')
             self.attack = Pokemon.calculate_stat(attack, level, iv, ev, statname='attack')
@@ -100,17 +141,23 @@ class Pokemon(Loggable):
         self.level = level
         self.hp = self.maxhp
 
-        self.dbg(str(self))
+        if __debug__:
+            self.dbg('%s', self)
 
     def compare(self, other):
         return (other.name == self.name and other.type == self.type and other.maxhp == self.maxhp
                 and other.attack == self.attack and other.defense == self.defense and other.spatk == self.spatk
                 and other.spdef == self.spdef and other.speed == self.speed)
 
+    def battle_key(self):
+        """Everything besides hp that decides how this pokemon fights, pokemon with equal keys are interchangeable"""
+        return (self.type_codes, self.level, self.attack, self.defense, self.spatk, self.spdef, self.speed)
+
     @classmethod
     def from_data_frame(cls, poketable, level=0, iv=0, ev=0, calcstat=True):
         """Create a list of pokemon from a dataframe describing the pokemon
         this function does not work if you want to repeat pokemon..."""
+        import pandas as pd
         pokemonlist = []
         if isinstance(poketable, pd.DataFrame):
             for i in poketable.index:
@@ -141,21 +188,49 @@ class Pokemon(Loggable):
             speed = poketable["speed"]
             pokemonlist = cls(name, type1, type2, hp, attack, defense, spatk, spdef, speed,
                               level=level, iv=iv, ev=ev, calcstat=calcstat)
-        cls.dbg(str(pokemonlist))
+        if __debug__:
+            cls.dbg('%s', pokemonlist)
         return pokemonlist
 
+    def clone(self):
+        """Copy of this pokemon at full hp, stats and types are shared with the original"""
+        clone = object.__new__(type(self))
+        for attr in self.__slots__:
+            setattr(clone, attr, getattr(self, attr))
+        clone.hp = clone.maxhp
+        return clone
+
     @classmethod
-    def create_pokemon_generator(cls, pokemon_table):
+    def create_pokemon_generator(cls, pokemon_table, level=0, iv=0, ev=0):
         """This returns a function that takes a list of (possibly non-unique) indices for the given poketable
-        returns a list of those pokemon"""
-        return lambda x: [cls.from_data_frame(pokemon_table.loc[i]) for i in x] if isinstance(x, list) \
-            else cls.from_data_frame(pokemon_table.loc[x])
+        returns a list of those pokemon
+
+        Each row is only turned into a Pokemon once, for every (index, level, iv, ev) the generator is asked
+        for, later calls get clones of that prototype at full hp. The returned function takes optional
+        level, iv and ev arguments that override the generator's defaults.
+        """
+        prototypes = {}
+
+        def generate(x, level=level, iv=iv, ev=ev):
+            if isinstance(x, list):
+                return [generate(i, level, iv, ev) for i in x]
+            key = (x, level, iv, ev)
+            try:
+                prototype = prototypes.get(key)
+            except TypeError:
+                # arrays of indices cannot be keys, they are generated like lists
+                return [generate(i, level, iv, ev) for i in list(x)]
+            if prototype is None:
+                prototype = prototypes[key] = cls.from_data_frame(pokemon_table.loc[x], level, iv, ev)
+            return prototype.clone()
+        generate.prototypes = prototypes
+        return generate
 
     def is_ko(self):
         """Returns true if this pokemon is knocked out, false otherwise"""
         ko = self.hp == 0
-        if ko:
-            self.dbg(self.name + ' ' + str(ko))
+        if __debug__ and ko:
+            self.dbg('%s %s', self.name, ko)
         return ko
 
     def deterministically_inferior_to(self, other):
@@ -168,17 +243,20 @@ class Pokemon(Loggable):
              and (self.spatk < other.spatk)
              and (self.spdef < other.spdef)
              and (self.speed < other.speed))
-        self.dbg(self.name + ' inferior to ' + other.name + ': ' + str(inferior))
+        if __debug__:
+            self.dbg('%s inferior to %s: %s', self.name, other.name, inferior)
         return inferior
 
     def take_damage(self, damage):
         """apply damage, make sure lowest hp is 0"""
         newhp = max(0, self.hp - damage)
-        self.dbg(self.name + ' takes ' + str(damage) + ' hp reduced to ' + str(newhp))
+        if __debug__:
+            self.dbg('%s takes %s hp reduced to %s', self.name, damage, newhp)
         self.hp = newhp
 
     def recover(self):
-        self.dbg(self.name + ' recovered')
+        if __debug__:
+            self.dbg('%s recovered', self.name)
         self.hp = self.maxhp
 
     @staticmethod
@@ -186,37 +264,32 @@ class Pokemon(Loggable):
         """This algorithm is based on https://www.math.miami.edu/~jam/azure/compendium/battdam.htm"""
         return int((((((((((2 * a // 5 + 2) * b) * c) // d) // 50) + 2) * x) * y) * z) // 255)
 
-    def calculate_damage(self, other_pokemon):
-        """Calculate the damage this pokemon can do to other_pokemon"""
+    def calculate_damage(self, other_pokemon, rng=None):
+        """Calculate the damage this pokemon can do to other_pokemon
+        with a random number source rng, the attack can be a critical hit and the damage roll is random,
+        otherwise there is no critical hit and the roll is the average one"""
+        damage_calls[0] += 1
         # Set independent values (pokemon-agnostic)
-        """# use random critical hit
-        if np.random.rand() < .05:
-            critical_hit = 1
-        else:
+        if rng is None:
             critical_hit = 0
-        """
-        # no critical hit
-        critical_hit = 0
+            z = Pokemon.averageDamageRoll
+        else:
+            critical_hit = int(rng.random() < Pokemon.criticalHitRate)
+            # random value between 217 and 255
+            z = int(Pokemon.minDamageRoll + (Pokemon.maxDamageRoll - Pokemon.minDamageRoll) * rng.random())
 
         a = self.level * (1 + critical_hit)  # level of pokemon
         c = Pokemon.standardAttackPower  # power of attack
         x = 1.5
-        """# use true random attack value
-        Z = int(217 + (255 - 217) * np.random.rand())  # random value  between 217 and 255
-        """
-        # use average attack value
-        z = round((217+255)/2)
-        damage = [0] * len(self.type)
+        damage = [0] * len(self.type_codes)
+        defense1, defense2 = other_pokemon.defense_codes
         # calculate estimated attack score for each attack type
-        for idx, attackType in enumerate(self.type):
-            # calculate type modifier y
-            y = 1
-            for defenseType in other_pokemon.type:
-                # lookup type modifier
-                y *= Pokemon.typeModifierTable[defenseType][attackType]
+        for idx, attackType in enumerate(self.type_codes):
+            # lookup type modifier y against both of the other pokemon's types
+            y = Pokemon.typeMultiplierLookup[attackType][defense1][defense2]
 
             # if this attack type is a physical attack, use attack stat
-            if attackType in Pokemon.physicalTypes:
+            if Pokemon.typeIsPhysical[attackType]:
                 b = self.attack  # attack score
                 d = other_pokemon.defense  # defense score
             else:  # otherwise use special attack
@@ -226,9 +299,9 @@ class Pokemon(Loggable):
             # calculate damage for this attack type
             damage[idx] = Pokemon.damage_equation(a, b, c, d, x, y, z)
 
-            self.dbg(self.name + ' evaluates ' + attackType + ' attack against ' + other_pokemon.name +
-                     " A: " + str(a) + " B: " + str(b) + " C: " + str(c) + " D: " + str(d) +
-                     " X: " + str(x) + " Y: " + str(y) + " Z: " + str(z) + ' damage: ' + str(damage[idx]))
+            if __debug__:
+                self.dbg('%s evaluates %s attack against %s A: %s B: %s C: %s D: %s X: %s Y: %s Z: %s damage: %s',
+                         self.name, self.typeNames[attackType], other_pokemon.name, a, b, c, d, x, y, z, damage[idx])
 
         # Add entry for non-same-type physical attack
         x = 1  # no STAB
@@ -236,17 +309,18 @@ class Pokemon(Loggable):
         d = other_pokemon.defense  # defense score
         y = 1  # no type modifier
         default_damage = Pokemon.damage_equation(a, b, c, d, x, y, z)
-        self.dbg(self.name + ' evaluates attack against ' + other_pokemon.name +
-                 " A: " + str(a) + " B: " + str(b) + " C: " + str(c) + " D: " + str(d) +
-                 " X: " + str(x) + " Y: " + str(y) + " Z: " + str(z) + ' damage: ' + str(default_damage))
+        if __debug__:
+            self.dbg('%s evaluates attack against %s A: %s B: %s C: %s D: %s X: %s Y: %s Z: %s damage: %s',
+                     self.name, other_pokemon.name, a, b, c, d, x, y, z, default_damage)
         damage.append(default_damage)
         # return maximum damage
         return max(damage)
 
-    def do_attack(self, other_pokemon):
-        """This pokemon attacks other_pokemon"""
-        damage = self.calculate_damage(other_pokemon)
-        self.dbg(self.name + " attacks " + other_pokemon.name + " for " + str(damage) + " damage")
+    def do_attack(self, other_pokemon, rng=None):
+        """This pokemon attacks other_pokemon, see calculate_damage for rng"""
+        damage = self.calculate_damage(other_pokemon, rng)
+        if __debug__:
+            self.dbg('%s attacks %s for %s damage', self.name, other_pokemon.name, damage)
         other_pokemon.take_damage(damage)
 
         return damage
@@ -0,0 +1,149 @@
+from pokedatasim.loggable import Loggable
+from pokedatasim.pokemon import Pokemon
+from pokedatasim.dataload import *
+import hashlib
+
+
+class PokemonArrays(Loggable):
+    """Battle stats of many pokemon held as numpy arrays, one entry per pokemon
+
+    Stats are the calculated values, as on a Pokemon object. types has shape (n, 2) and holds integer type
+    codes (see Pokemon.typeCodes), with Pokemon.noType in unused slots.
+    """
+    fields = ['level', 'maxhp', 'attack', 'defense', 'spatk', 'spdef', 'speed']
+
+    def __init__(self, level, maxhp, attack, defense, spatk, spdef, speed, types):
+        self.level = np.asarray(level, dtype=np.int64)
+        self.maxhp = np.asarray(maxhp, dtype=np.int64)
+        self.attack = np.asarray(attack, dtype=np.int64)
+        self.defense = np.asarray(defense, dtype=np.int64)
+        self.spatk = np.asarray(spatk, dtype=np.int64)
+        self.spdef = np.asarray(spdef, dtype=np.int64)
+        self.speed = np.asarray(speed, dtype=np.int64)
+        self.types = np.asarray(types, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.level)
+
+    @staticmethod
+    def calculate_stat(statbase, level, iv, ev, hp=False):
+        """Vectorized Pokemon.calculate_stat, the result is identical element by element"""
+        modifier = level + 10 if hp else 5
+        statbase = np.asarray(statbase, dtype=np.int64)
+        return (((2 * statbase) + iv + int(ev / 4)) * level / 100 + modifier).astype(np.int64)
+
+    @staticmethod
+    def encode_types(type1, type2):
+        """Integer type codes of each pokemon, invalid types are dropped like in the Pokemon constructor"""
+        codes = np.array([[Pokemon.typeCodes.get(t, Pokemon.noType) for t in pair] for pair in zip(type1, type2)],
+                         dtype=np.int64).reshape(-1, 2)
+        # move a lone valid second type into the first slot
+        shift = codes[:, 0] == Pokemon.noType
+        codes[shift] = codes[shift, ::-1]
+        return codes
+
+    @classmethod
+    def from_data_frame(cls, poketable, level=0, iv=0, ev=0):
+        """Calculate the stats of every row of a pokemon table, like Pokemon.from_data_frame"""
+        level = level or Pokemon.standardLevel
+        iv = iv or Pokemon.standardIV
+        ev = ev or Pokemon.standardEV
+        return cls(np.full(len(poketable), level),
+                   cls.calculate_stat(poketable.hp.values, level, iv, ev, hp=True),
+                   cls.calculate_stat(poketable.attack.values, level, iv, ev),
+                   cls.calculate_stat(poketable.defense.values, level, iv, ev),
+                   cls.calculate_stat(poketable.spatk.values, level, iv, ev),
+                   cls.calculate_stat(poketable.spdef.values, level, iv, ev),
+                   cls.calculate_stat(poketable.speed.values, level, iv, ev),
+                   cls.encode_types(poketable.type1.values, poketable.type2.values))
+
+    @classmethod
+    def from_pokemon(cls, pokemonlist):
+        """Collect the stats of a list of Pokemon objects"""
+        return cls([p.level for p in pokemonlist], [p.maxhp for p in pokemonlist],
+                   [p.attack for p in pokemonlist], [p.defense for p in pokemonlist],
+                   [p.spatk for p in pokemonlist], [p.spdef for p in pokemonlist],
+                   [p.speed for p in pokemonlist], [p.defense_codes for p in pokemonlist])
+
+    def take(self, indices):
+        """Return the stats of the pokemon at indices, indices may be an array of any shape"""
+        return PokemonArrays(*[getattr(self, f)[indices] for f in self.fields], self.types[indices])
+
+    def key(self):
+        """Digest of the stats, used to identify cached results computed from them"""
+        digest = hashlib.sha1()
+        for f in self.fields + ['types']:
+            digest.update(np.ascontiguousarray(getattr(self, f)).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def damage_equation(a, b, c, d, x, y, z):
+        """Vectorized Pokemon.damage_equation
+        integer operands stay integer and float operands are combined in the same order, so the floor divisions
+        give the same result as the scalar version"""
+        return np.floor_divide((((2 * a // 5 + 2) * b * c // d // 50 + 2) * x * y) * z, 255).astype(np.int64)
+
+    def power(self, other, attack_power=0, critical=False):
+        """Damage of these pokemon attacking the other pokemon before the damage roll and the division by 255
+        the best attack is chosen, damage is floor(power * z / 255) for a roll z. The arrays of self and other
+        are broadcast against each other, a critical hit doubles the attacker's level."""
+        c = attack_power or Pokemon.standardAttackPower
+        a = self.level * 2 if critical else self.level
+        physical = np.array(Pokemon.typeIsPhysical)
+        defense1 = other.types[..., 0]
+        defense2 = other.types[..., 1]
+        # integer part of damage_equation
+        core = lambda b, d: (2 * a // 5 + 2) * b * c // d // 50 + 2
+        # non-same-type physical attack
+        power = core(self.attack, other.defense).astype(float)
+        for slot in range(2):
+            attack_type = self.types[..., slot]
+            y = Pokemon.typeMultiplier[attack_type, defense1, defense2]
+            b = np.where(physical[attack_type], self.attack, self.spatk)
+            d = np.where(physical[attack_type], other.defense, other.spdef)
+            typed = core(b, d) * 1.5 * y
+            power = np.maximum(power, np.where(attack_type == Pokemon.noType, 0, typed))
+        return power
+
+    @staticmethod
+    def roll_damage(power, z):
+        """Damage for the power of an attack and a damage roll z, power * z is rounded like in damage_equation
+        and the floor is monotonic, so this is the best attack's damage for that roll"""
+        return np.floor_divide(power * z, 255).astype(np.int64)
+
+    def damage(self, other, attack_power=0):
+        """Vectorized Pokemon.calculate_damage of these pokemon attacking the other pokemon
+        the arrays of self and other are broadcast against each other"""
+        return self.roll_damage(self.power(other, attack_power), Pokemon.averageDamageRoll)
+
+    def pairwise_damage(self, other=None, attack_power=0):
+        """Matrix of the damage pokemon i of self does to pokemon j of other (self if other is None)"""
+        if other is None:
+            other = self
+        return self.take(np.s_[:, None]).damage(other.take(np.s_[None, :]), attack_power=attack_power)
+
+
+def save_array(fname, array):
+    # np.save appends .npy to names without it
+    with open(fname, 'wb') as f:
+        np.save(f, array)
+
+
+def load_damage_matrix(poketable=None, level=0, iv=0, ev=0, attack_power=0, use_cache=True):
+    """Damage matrix of every pokemon in poketable (all pokemon by default) attacking every other one
+    entry [i, j] is what the i-th row of poketable does to the j-th row. The matrix is cached on disk (see cache_dir)
+    keyed by the pokemon stats, the type multipliers and the damage parameters."""
+    if poketable is None:
+        poketable = load_pokemon()
+    arrays = PokemonArrays.from_data_frame(poketable, level=level, iv=iv, ev=ev)
+    attack_power = attack_power or Pokemon.standardAttackPower
+    types = hashlib.sha1(np.ascontiguousarray(Pokemon.typeMultiplier).tobytes()).hexdigest()
+    fname = os.path.join(cache_dir(), 'damage-' + arrays.key() + '-' + types + '-' + str(attack_power) + '.npy')
+    if use_cache and os.path.exists(fname):
+        PokemonArrays.dbg('loading %s', fname)
+        return np.load(fname)
+    damage = arrays.pairwise_damage(attack_power=attack_power)
+    if use_cache:
+        atomic_write(fname, lambda tmp: save_array(tmp, damage))
+        PokemonArrays.dbg('saved %s', fname)
+    return damage
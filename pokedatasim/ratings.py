@@ -0,0 +1,159 @@
+from pokedatasim.resultsink import ResultSink, team_members
+import numpy as np
+import json
+
+
+def team_name(tables, team):
+    """Name of a team: the trainer's name if it has one, otherwise the names of its pokemon"""
+    if tables['names'] and tables['names'][team]:
+        return tables['names'][team]
+    return '/'.join(tables['pokemon'][m]['name'] for m in team_members(tables, team))
+
+
+def leaderboard(ratings, wins=None, games=None, top=None):
+    """Rank a dictionary of ratings by name, highest first
+    returns a list of dictionaries with the rank, name and rating, plus wins and games if given"""
+    board = []
+    for rank, name in enumerate(sorted(ratings, key=lambda name: -ratings[name])[:top], start=1):
+        row = {'rank': rank, 'name': name, 'rating': float(ratings[name])}
+        if wins is not None:
+            row['wins'] = int(wins[name])
+        if games is not None:
+            row['games'] = int(games[name])
+        board.append(row)
+    return board
+
+
+def format_leaderboard(board):
+    lines = []
+    for row in board:
+        line = '{:5d}  {:30s}{:8.1f}'.format(row['rank'], row['name'], row['rating'])
+        if 'games' in row:
+            line += '{:8d} /{:8d}'.format(row['wins'], row['games'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+class EloSink(ResultSink):
+    """Online Elo ratings of the teams and the pokemon, updated as results arrive
+
+    Teams are rated by their index (see team_tables), pokemon by name, so a species that appears in several
+    trainers' teams of a TrainerListPokeDataSim has one rating. A battle moves the winning team's rating up and
+    the losing team's down by k times the winner's surprise, 1 - 1 / (1 + 10**((loser - winner) / 400)).
+    Every member of a team gets the change computed from the average rating of the members of both teams, which
+    for 1v1 battles is plain Elo. Ratings depend on the order of the results, which is the case index order
+    also in a parallel run.
+    close() logs the top of both leaderboards and, with a fname, writes them in full to that json file.
+    """
+    records = False
+
+    def __init__(self, fname=None, k=32, initial=1500, top=10):
+        self.fname = fname
+        self.k = k
+        self.initial = initial
+        self.top = top
+        self.tables = None
+        self.reset()
+
+    def reset(self):
+        self.team_ratings = {}
+        self.team_wins = {}
+        self.team_games = {}
+        self.ratings = {}
+        self.wins = {}
+        self.games = {}
+
+    def open(self, sim=None):
+        self.tables = sim.team_tables()
+        self.reset()
+
+    def entry(self, result, case):
+        return self.winner_loser(case)[2:]
+
+    def surprise(self, winner, loser):
+        """k times how unexpected a win of a winner rated winner over a loser rated loser is"""
+        return self.k / (1 + 10 ** ((winner - loser) / 400))
+
+    def write_entry(self, entry):
+        winner, loser = entry
+        initial = self.initial
+        delta = self.surprise(self.team_ratings.get(winner, initial), self.team_ratings.get(loser, initial))
+        for team, change, won in [(winner, delta, 1), (loser, -delta, 0)]:
+            self.team_ratings[team] = self.team_ratings.get(team, initial) + change
+            self.team_wins[team] = self.team_wins.get(team, 0) + won
+            self.team_games[team] = self.team_games.get(team, 0) + 1
+
+        pokemon = self.tables['pokemon']
+        winners = [pokemon[m]['name'] for m in team_members(self.tables, winner)]
+        losers = [pokemon[m]['name'] for m in team_members(self.tables, loser)]
+        ratings = self.ratings
+        delta = self.surprise(sum(ratings.get(name, initial) for name in winners) / len(winners),
+                              sum(ratings.get(name, initial) for name in losers) / len(losers))
+        for names, change, won in [(winners, delta, 1), (losers, -delta, 0)]:
+            for name in names:
+                ratings[name] = ratings.get(name, initial) + change
+                self.wins[name] = self.wins.get(name, 0) + won
+                self.games[name] = self.games.get(name, 0) + 1
+
+    def pokemon_leaderboard(self, top=None):
+        return leaderboard(self.ratings, self.wins, self.games, top)
+
+    def team_leaderboard(self, top=None):
+        names = {team: team_name(self.tables, team) for team in self.team_ratings}
+        ratings = {names[team]: rating for team, rating in self.team_ratings.items()}
+        wins = {names[team]: self.team_wins[team] for team in self.team_ratings}
+        games = {names[team]: self.team_games[team] for team in self.team_ratings}
+        return leaderboard(ratings, wins, games, top)
+
+    def close(self):
+        if self.tables is None:
+            return
+        self.info('top pokemon by Elo rating:\n%s', format_leaderboard(self.pokemon_leaderboard(self.top)))
+        if self.tables['n_pokemon_team'] > 1 or self.tables['names']:
+            self.info('top teams by Elo rating:\n%s', format_leaderboard(self.team_leaderboard(self.top)))
+        if self.fname:
+            with open(self.fname, 'w') as f:
+                json.dump({'pokemon': self.pokemon_leaderboard(), 'teams': self.team_leaderboard()}, f, indent=2)
+
+    def checkpoint(self):
+        # json turns integer keys into strings, so the team dictionaries are stored as lists of items
+        return {'teams': [[team, self.team_ratings[team], self.team_wins[team], self.team_games[team]]
+                          for team in self.team_ratings],
+                'ratings': self.ratings, 'wins': self.wins, 'games': self.games}
+
+    def resume(self, sim, state):
+        self.open(sim)
+        for team, rating, wins, games in state['teams']:
+            self.team_ratings[team] = rating
+            self.team_wins[team] = wins
+            self.team_games[team] = games
+        self.ratings.update(state['ratings'])
+        self.wins.update(state['wins'])
+        self.games.update(state['games'])
+
+
+def bradley_terry(wins, prior=0.5, tol=1e-10, max_iter=10000):
+    """Fit Bradley-Terry strengths to a win matrix, wins[i, j] being how often i beat j (see WinMatrixSink)
+
+    Team i beats team j with probability strength[i] / (strength[i] + strength[j]). The fit uses the
+    minorization-maximization updates of Hunter (2004) on the whole matrix at once. Every team also gets prior
+    wins and prior losses against a virtual team of strength 1, which keeps the strengths of unbeaten and
+    winless teams finite. The strengths returned are scaled to a geometric mean of 1.
+    """
+    wins = np.asarray(wins, dtype=float)
+    games = wins + wins.T
+    total_wins = wins.sum(axis=1) + prior
+    strength = np.ones(len(wins))
+    for i in range(max_iter):
+        pairs = games / (strength[:, None] + strength[None, :])
+        updated = total_wins / (pairs.sum(axis=1) + 2 * prior / (strength + 1))
+        converged = np.abs(updated - strength).max() <= tol * updated.max()
+        strength = updated
+        if converged:
+            break
+    return strength / np.exp(np.log(strength).mean())
+
+
+def bradley_terry_ratings(wins, prior=0.5, initial=1500):
+    """Bradley-Terry strengths on the Elo scale: a 400 point difference means 10 to 1 odds"""
+    return initial + 400 * np.log10(bradley_terry(wins, prior))
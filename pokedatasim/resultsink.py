@@ -0,0 +1,727 @@
+from pokedatasim.loggable import Loggable
+from pokedatasim.dataload import atomic_write
+import numpy as np
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+
+def team_members(tables, team):
+    """Positions in tables['pokemon'] of the pokemon of a team, tables as returned by a simulation's team_tables()"""
+    if tables['teams'] is not None:
+        return tables['teams'][team]
+    npokemon = len(tables['pokemon'])
+    members = []
+    for i in range(tables['n_pokemon_team']):
+        team, member = divmod(team, npokemon)
+        members.insert(0, member)
+    return members
+
+
+class ResultSink(Loggable):
+    """Destination for the results of a simulation
+
+    PokeDataSimulation.run_simulation opens its sink, writes every finished case to it and closes it at the end.
+    write() gets the case's result record (None if the sink sets records = False) and the case dictionary
+    from setup_case with the outcome added. entry() turns these into what the sink stores for the case, a
+    snapshot that no longer refers to the trainers, and write_entry() stores it.
+    Worker processes of a parallel run collect entries in a partial() sink, which the parent process merge()s
+    into its own sink in case index order.
+    Sinks that store results in a file can continue an interrupted run: checkpoint() flushes and describes how
+    much has been stored, resume() reopens the sink at that point.
+    """
+    records = True
+
+    def open(self, sim=None):
+        """Prepare for a new run of sim"""
+        pass
+
+    def entry(self, result, case):
+        return result
+
+    @staticmethod
+    def winner_loser(case):
+        """The winning and the losing trainer of a finished case, followed by their team indices"""
+        if case['t1win']:
+            return case['t1'], case['t2'], case['team1'], case['team2']
+        return case['t2'], case['t1'], case['team2'], case['team1']
+
+    def write(self, result, case=None):
+        self.write_entry(self.entry(result, case))
+
+    def write_entry(self, entry):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Finish the run, everything written so far is stored when this returns"""
+        self.flush()
+
+    def checkpoint(self):
+        """Flush and return a json serializable state that resume() can continue from"""
+        self.flush()
+        return None
+
+    def resume(self, sim, state):
+        """Prepare for continuing a run of sim, keeping what was stored up to the checkpoint() that returned state"""
+        raise NotImplementedError(type(self).__name__ + ' cannot resume a run')
+
+    def partial(self):
+        """Empty sink that collects the entries of part of the cases in a worker process"""
+        return ListSink(entry=self.entry)
+
+    def merge(self, partial):
+        """Add the entries collected by a partial sink"""
+        for entry in partial.results:
+            self.write_entry(entry)
+
+
+class ListSink(ResultSink):
+    """Keeps all results in memory, in the list self.results
+    entry can replace the function that turns a result and its case into what is kept"""
+
+    def __init__(self, entry=None):
+        self.results = []
+        if entry is not None:
+            self.entry = entry
+
+    def open(self, sim=None):
+        self.results = []
+
+    def write_entry(self, entry):
+        self.results.append(entry)
+
+
+class JsonLinesSink(ResultSink):
+    """Streams results to a file with one json record per line
+
+    Results are buffered and written batch_size at a time, so memory use does not grow with the number of cases
+    and a crashed run keeps everything up to the last full batch.
+    """
+
+    def __init__(self, fname, batch_size=1000):
+        self.fname = fname
+        self.batch_size = batch_size
+        self.buffer = []
+        self.file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['buffer'] = []
+        return state
+
+    def open(self, sim=None, mode='w'):
+        self.buffer = []
+        self.file = open(self.fname, mode)
+
+    def write_entry(self, entry):
+        self.buffer.append(entry)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(''.join(json.dumps(result) + '\n' for result in self.buffer))
+            self.buffer = []
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def checkpoint(self):
+        self.flush()
+        return {'offset': self.file.tell()}
+
+    def resume(self, sim, state):
+        self.open(sim, mode='r+')
+        self.file.truncate(state['offset'])
+        self.file.seek(state['offset'])
+
+    @staticmethod
+    def read(fname):
+        """Iterate over the results stored in a json lines file"""
+        with open(fname) as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class ColumnarSink(ResultSink):
+    """Stores one fixed size row per battle in a flat binary file instead of result records
+
+    A row holds the case index, the winning and losing team (index of the team for FullFactPokeDataSim, of the
+    trainer for TrainerListPokeDataSim), the number of turns and the remaining hp of each team member
+    (-1 past the end of smaller teams). The pokemon and teams are described once, from the simulation's
+    team_tables(), in fname + '.json'. Rows are appended batch_size at a time and can be read back as a
+    memory-mapped structured array with ColumnarResults, which also rebuilds result records on demand.
+    """
+    records = False
+
+    def __init__(self, fname=None, batch_size=4096):
+        self.fname = fname
+        self.batch_size = batch_size
+        self.dtype = None
+        self.team_size = 0
+        self.rows = []
+        self.blocks = []
+        self.file = None
+
+    def __getstate__(self):
+        # open files stay with the process that opened them, rows of a partial sink travel with it
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
+    @staticmethod
+    def row_dtype(team_size, nteams):
+        """Layout of a row, team indices take the smallest integer type that holds nteams"""
+        team = np.min_scalar_type(-nteams)
+        return np.dtype([('caseidx', np.int64), ('winner', team), ('loser', team), ('turns', np.int32),
+                         ('winner_hp', np.int16, (team_size,)), ('loser_hp', np.int16, (team_size,))])
+
+    def open(self, sim=None, mode='wb'):
+        tables = sim.team_tables()
+        self.team_size = tables['n_pokemon_team']
+        self.dtype = self.row_dtype(self.team_size, tables['nteams'])
+        self.rows = []
+        self.blocks = []
+        if self.fname:
+            with open(self.fname + '.json', 'w') as f:
+                json.dump({'simname': sim.simname, 'tables': tables}, f)
+            self.file = open(self.fname, mode)
+
+    def entry(self, result, case):
+        winner, loser, wteam, lteam = self.winner_loser(case)
+        padding = [-1] * self.team_size
+        return (case['caseidx'], wteam, lteam, case['t1'].turns,
+                ([p.hp for p in winner.pokemon] + padding)[:self.team_size],
+                ([p.hp for p in loser.pokemon] + padding)[:self.team_size])
+
+    def write_entry(self, entry):
+        self.rows.append(entry)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            block = np.array(self.rows, dtype=self.dtype)
+            self.rows = []
+            if self.file:
+                block.tofile(self.file)
+            else:
+                self.blocks.append(block)
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def checkpoint(self):
+        self.flush()
+        return {'offset': self.file.tell()} if self.file else None
+
+    def resume(self, sim, state):
+        if not self.fname:
+            super().resume(sim, state)
+        self.open(sim, mode='r+b')
+        self.file.truncate(state['offset'])
+        self.file.seek(state['offset'])
+
+    def partial(self):
+        partial = ColumnarSink(batch_size=self.batch_size)
+        partial.team_size = self.team_size
+        partial.dtype = self.dtype
+        return partial
+
+    def merge(self, partial):
+        self.flush()
+        for block in partial.blocks:
+            if self.file:
+                block.tofile(self.file)
+            else:
+                self.blocks.append(block)
+
+    def columns(self):
+        """Rows kept in memory by a sink without a file"""
+        return np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=self.dtype)
+
+
+class ColumnarResults(Loggable):
+    """Read back the output of a ColumnarSink, self.columns is a memory-mapped structured array of the rows"""
+
+    def __init__(self, fname):
+        with open(fname + '.json') as f:
+            meta = json.load(f)
+        self.simname = meta['simname']
+        self.tables = meta['tables']
+        dtype = ColumnarSink.row_dtype(self.tables['n_pokemon_team'], self.tables['nteams'])
+        if os.path.getsize(fname):
+            self.columns = np.memmap(fname, dtype=dtype, mode='r')
+        else:
+            self.columns = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def team_members(self, team):
+        """Positions in self.tables['pokemon'] of the pokemon of a team"""
+        return team_members(self.tables, team)
+
+    def team_dict(self, team, hp):
+        """Trainer.to_dict() of a team with the given remaining hp"""
+        name = self.tables['names'][team] if self.tables['names'] else ''
+        pokemon = [dict(self.tables['pokemon'][m], hp=int(h)) for m, h in zip(self.team_members(team), hp)]
+        return {'name': name, 'pokemon': pokemon}
+
+    def record(self, i):
+        """Rebuild the result record of row i, as a ListSink would have stored it"""
+        row = self.columns[i]
+        return {'Winner': self.team_dict(int(row['winner']), row['winner_hp']),
+                'Loser': self.team_dict(int(row['loser']), row['loser_hp'])}
+
+    def __iter__(self):
+        return (self.record(i) for i in range(len(self)))
+
+
+class SqliteSink(ResultSink):
+    """Stores the battles of a simulation in an indexed SQLite database
+
+    The schema is normalized: pokemon and teams are stored once per run, a battle row holds the case index, the
+    winning and losing team, the number of turns and the remaining hp of both teams (json lists). Every table
+    has the run id of the simulation (see the runs table), so one database file holds the runs of several
+    simulations; a new run of a simulation replaces its previous one, like save_results_to_tinydb does.
+    Teams of a FullFactPokeDataSim are only stored once they fight.
+    Battles are inserted batch_size at a time with executemany, one transaction per batch, in WAL mode. The
+    indexes on winner, loser, case index and pokemon names are built by close(), which is faster than keeping
+    them up to date during the run. Read the database back with SqliteResults.
+    """
+    records = False
+    pokemon_fields = ['name', 'level', 'type1', 'type2', 'maxhp', 'attack', 'defense', 'spatk', 'spdef', 'speed']
+    schema = """
+        CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, simname TEXT UNIQUE, n_pokemon_team INTEGER);
+        CREATE TABLE IF NOT EXISTS pokemon (run_id INTEGER, id INTEGER, name TEXT, level INTEGER, type1 TEXT,
+            type2 TEXT, maxhp INTEGER, attack INTEGER, defense INTEGER, spatk INTEGER, spdef INTEGER,
+            speed INTEGER, PRIMARY KEY (run_id, id));
+        CREATE TABLE IF NOT EXISTS teams (run_id INTEGER, id INTEGER, name TEXT, PRIMARY KEY (run_id, id));
+        CREATE TABLE IF NOT EXISTS team_members (run_id INTEGER, team_id INTEGER, slot INTEGER, pokemon_id INTEGER,
+            PRIMARY KEY (run_id, team_id, slot));
+        CREATE TABLE IF NOT EXISTS battles (id INTEGER PRIMARY KEY, run_id INTEGER, caseidx INTEGER,
+            winner INTEGER, loser INTEGER, turns INTEGER, winner_hp TEXT, loser_hp TEXT);
+    """
+    indexes = """
+        CREATE INDEX IF NOT EXISTS battles_winner ON battles (run_id, winner);
+        CREATE INDEX IF NOT EXISTS battles_loser ON battles (run_id, loser);
+        CREATE INDEX IF NOT EXISTS battles_caseidx ON battles (run_id, caseidx);
+        CREATE INDEX IF NOT EXISTS pokemon_name ON pokemon (run_id, name);
+        CREATE INDEX IF NOT EXISTS team_members_pokemon ON team_members (run_id, pokemon_id);
+    """
+
+    def __init__(self, fname, batch_size=10000):
+        self.fname = fname
+        self.batch_size = batch_size
+        self.rows = []
+        self.db = None
+        self.run_id = None
+        self.tables = None
+        self.stored_teams = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(db=None, rows=[], stored_teams=set())
+        return state
+
+    def connect(self):
+        # a ThreadedSink writes from its own thread, one thread at a time, which sqlite allows with this flag
+        self.db = sqlite3.connect(self.fname, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.schema)
+
+    def open(self, sim=None):
+        self.tables = sim.team_tables()
+        self.rows = []
+        self.stored_teams = set()
+        self.connect()
+        with self.db:
+            old = self.db.execute('SELECT id FROM runs WHERE simname = ?', (sim.simname,)).fetchone()
+            if old:
+                for table in ['battles', 'team_members', 'teams', 'pokemon']:
+                    self.db.execute('DELETE FROM ' + table + ' WHERE run_id = ?', old)
+                self.db.execute('DELETE FROM runs WHERE id = ?', old)
+            self.run_id = self.db.execute('INSERT INTO runs (simname, n_pokemon_team) VALUES (?, ?)',
+                                          (sim.simname, self.tables['n_pokemon_team'])).lastrowid
+            self.db.executemany('INSERT INTO pokemon VALUES (' + ', '.join(['?'] * 12) + ')',
+                                [(self.run_id, i) + tuple(p[f] for f in self.pokemon_fields)
+                                 for i, p in enumerate(self.tables['pokemon'])])
+            if self.tables['teams'] is not None:
+                self.store_teams(range(len(self.tables['teams'])))
+
+    def store_teams(self, teams):
+        """Insert the teams that are not stored yet, within the caller's transaction"""
+        new = [team for team in teams if team not in self.stored_teams]
+        names = self.tables['names']
+        self.db.executemany('INSERT OR IGNORE INTO teams VALUES (?, ?, ?)',
+                            [(self.run_id, team, names[team] if names else None) for team in new])
+        self.db.executemany('INSERT OR IGNORE INTO team_members VALUES (?, ?, ?, ?)',
+                            [(self.run_id, team, slot, member) for team in new
+                             for slot, member in enumerate(team_members(self.tables, team))])
+        self.stored_teams.update(new)
+
+    def entry(self, result, case):
+        winner, loser, wteam, lteam = self.winner_loser(case)
+        return (case['caseidx'], wteam, lteam, case['t1'].turns,
+                json.dumps([p.hp for p in winner.pokemon]), json.dumps([p.hp for p in loser.pokemon]))
+
+    def write_entry(self, entry):
+        self.rows.append(entry)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows and self.db:
+            with self.db:
+                if self.tables['teams'] is None:
+                    self.store_teams({team for row in self.rows for team in row[1:3]})
+                self.db.executemany('INSERT INTO battles (run_id, caseidx, winner, loser, turns, winner_hp, loser_hp) '
+                                    'VALUES (' + str(int(self.run_id)) + ', ?, ?, ?, ?, ?, ?)', self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.db:
+            self.db.executescript(self.indexes)
+            self.db.close()
+            self.db = None
+
+    def checkpoint(self):
+        self.flush()
+        last = self.db.execute('SELECT max(id) FROM battles WHERE run_id = ?', (self.run_id,)).fetchone()[0]
+        return {'run_id': self.run_id, 'battle_id': last or 0}
+
+    def resume(self, sim, state):
+        self.tables = sim.team_tables()
+        self.rows = []
+        self.run_id = state['run_id']
+        self.connect()
+        with self.db:
+            self.db.execute('DELETE FROM battles WHERE run_id = ? AND id > ?', (self.run_id, state['battle_id']))
+        self.stored_teams = {team for team, in self.db.execute('SELECT id FROM teams WHERE run_id = ?',
+                                                                 (self.run_id,))}
+
+
+class SqliteResults(Loggable):
+    """Queries on the results of a simulation stored by a SqliteSink"""
+
+    def __init__(self, fname, simname):
+        self.db = sqlite3.connect(fname)
+        row = self.db.execute('SELECT id FROM runs WHERE simname = ?', (simname,)).fetchone()
+        if row is None:
+            raise KeyError('no results of simulation ' + repr(simname) + ' in ' + repr(fname))
+        self.run_id = row[0]
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM battles WHERE run_id = ?', (self.run_id,)).fetchone()[0]
+
+    def battles_of(self, name, side):
+        """(case index, winner, loser, turns) of the battles won (side 'winner') or lost (side 'loser') by teams
+        with a pokemon called name"""
+        if side not in ('winner', 'loser'):
+            raise ValueError('side is winner or loser, not ' + repr(side))
+        # CROSS JOIN keeps sqlite to this order: pokemon by name, their teams, then those teams' battles
+        return self.db.execute(
+            'SELECT DISTINCT b.caseidx, b.winner, b.loser, b.turns FROM pokemon p '
+            'CROSS JOIN team_members m ON m.run_id = p.run_id AND m.pokemon_id = p.id '
+            'CROSS JOIN battles b ON b.run_id = m.run_id AND b.' + side + ' = m.team_id '
+            'WHERE p.run_id = ? AND p.name = ? ORDER BY b.id', (self.run_id, name)).fetchall()
+
+    def wins(self, name):
+        return self.battles_of(name, 'winner')
+
+    def losses(self, name):
+        return self.battles_of(name, 'loser')
+
+    def team_dict(self, team, hp):
+        """Trainer.to_dict() of a team with the given remaining hp"""
+        name = self.db.execute('SELECT name FROM teams WHERE run_id = ? AND id = ?', (self.run_id, team)).fetchone()
+        members = self.db.execute(
+            'SELECT ' + ', '.join('p.' + f for f in SqliteSink.pokemon_fields) + ' FROM team_members m '
+            'JOIN pokemon p ON p.run_id = m.run_id AND p.id = m.pokemon_id '
+            'WHERE m.run_id = ? AND m.team_id = ? ORDER BY m.slot', (self.run_id, team)).fetchall()
+        pokemon = []
+        for values, h in zip(members, hp):
+            p = dict(zip(SqliteSink.pokemon_fields, values))
+            p['hp'] = h
+            pokemon.append(p)
+        return {'name': name[0] or '', 'pokemon': pokemon}
+
+    def __iter__(self):
+        """Result records in the order they were stored, as a ListSink would have kept them"""
+        rows = self.db.execute('SELECT winner, loser, winner_hp, loser_hp FROM battles WHERE run_id = ? ORDER BY id',
+                               (self.run_id,))
+        for winner, loser, winner_hp, loser_hp in rows:
+            yield {'Winner': self.team_dict(winner, json.loads(winner_hp)),
+                   'Loser': self.team_dict(loser, json.loads(loser_hp))}
+
+
+class WinMatrixSink(ResultSink):
+    """Counts the wins of every team against every other team instead of storing results
+
+    self.wins is a (number of teams) x (number of teams) integer array, wins[i, j] is how often team i beat
+    team j, so the losses are its transpose. Teams are numbered as in the simulation's team_tables(): the
+    team index for FullFactPokeDataSim (the pokemon's position in pokemon_indices for 1v1), the trainer's
+    position for TrainerListPokeDataSim. A sink set up for more than max_teams teams raises ValueError, as the
+    matrix grows with the square of their number: the default of 4096 teams takes 128 MB, raise it if a run
+    needs more and the memory is there.
+    Counts are buffered and added batch_size at a time. Sinks of separate runs (shards) over the same teams,
+    e.g. read back with load(), add up exactly with merge(). With a fname the matrix is saved there by close(),
+    and to fname + '.checkpoint' by checkpoint(), so an interrupted run can be resumed.
+    """
+    records = False
+
+    def __init__(self, fname=None, batch_size=4096, max_teams=4096):
+        self.fname = fname
+        self.batch_size = batch_size
+        self.max_teams = max_teams
+        self.simname = None
+        self.wins = np.zeros((0, 0), dtype=np.int64)
+        self.winners = []
+        self.losers = []
+
+    def __getstate__(self):
+        # workers only make partial sinks, the matrix stays with the parent process
+        state = self.__dict__.copy()
+        state.update(wins=np.zeros((0, 0), dtype=np.int64), winners=[], losers=[])
+        return state
+
+    def open(self, sim=None):
+        nteams = sim.team_tables()['nteams']
+        if nteams > self.max_teams:
+            raise ValueError('a win matrix of ' + str(nteams) + ' teams is larger than max_teams='
+                             + str(self.max_teams) + ', pass a larger max_teams to allow it')
+        self.simname = sim.simname
+        self.wins = np.zeros((nteams, nteams), dtype=np.int64)
+        self.winners = []
+        self.losers = []
+
+    def entry(self, result, case):
+        return self.winner_loser(case)[2:]
+
+    def write_entry(self, entry):
+        self.winners.append(entry[0])
+        self.losers.append(entry[1])
+        if len(self.winners) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.winners:
+            np.add.at(self.wins, (self.winners, self.losers), 1)
+            self.winners = []
+            self.losers = []
+
+    def close(self):
+        self.flush()
+        if self.fname:
+            self.save(self.fname)
+
+    def checkpoint(self):
+        # a copy of its own, as close() saves counts made after the checkpoint to fname
+        self.flush()
+        if not self.fname:
+            return None
+        self.save(self.fname + '.checkpoint')
+        return {'fname': self.fname + '.checkpoint'}
+
+    def resume(self, sim, state):
+        if not self.fname:
+            super().resume(sim, state)
+        self.open(sim)
+        self.wins += self.load(state['fname']).wins
+
+    def merge(self, partial):
+        """Add the entries of a partial sink, or the counts of another WinMatrixSink over the same teams"""
+        if not isinstance(partial, WinMatrixSink):
+            return super().merge(partial)
+        self.flush()
+        partial.flush()
+        if partial.wins.shape != self.wins.shape:
+            raise ValueError('cannot merge a win matrix of shape ' + str(partial.wins.shape) + ' into ' +
+                             str(self.wins.shape))
+        self.wins += partial.wins
+
+    @property
+    def losses(self):
+        """losses[i, j] is how often team i lost to team j"""
+        return self.wins.T
+
+    def win_rate(self):
+        """Fraction of the battles between teams i and j that team i won, nan for pairs that did not fight"""
+        games = self.wins + self.wins.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.wins / games
+
+    def save(self, fname):
+        atomic_write(fname, self.write_npz)
+
+    def write_npz(self, fname):
+        with open(fname, 'wb') as f:
+            np.savez(f, wins=self.wins, simname=str(self.simname))
+
+    @classmethod
+    def load(cls, fname):
+        """Sink holding the win matrix saved in fname, without a file of its own"""
+        sink = cls()
+        with np.load(fname) as data:
+            sink.wins = data['wins']
+            sink.simname = str(data['simname'])
+        return sink
+
+
+class TeeSink(ResultSink):
+    """Passes every result on to several sinks, e.g. to keep records and ratings of the same run
+
+    A sink that sets records = False gets None instead of the result record. The sinks' checkpoint states are
+    kept in a list, so the tee can resume if all of them can.
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self.records = any(sink.records for sink in sinks)
+
+    def open(self, sim=None):
+        for sink in self.sinks:
+            sink.open(sim)
+
+    def entry(self, result, case):
+        return tuple(sink.entry(result if sink.records else None, case) for sink in self.sinks)
+
+    def write_entry(self, entry):
+        for sink, e in zip(self.sinks, entry):
+            sink.write_entry(e)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def checkpoint(self):
+        return [sink.checkpoint() for sink in self.sinks]
+
+    def resume(self, sim, state):
+        for sink, s in zip(self.sinks, state):
+            sink.resume(sim, s)
+
+
+class ThreadedSink(ResultSink):
+    """Hands results to another sink on a background thread, so writing overlaps with simulating
+
+    Entries travel to the writer thread in batches of batch_size through a queue of at most queue_size batches.
+    When the writer falls behind, write() blocks until there is room, which keeps memory use bounded.
+    Errors raised by the writer are raised again by close().
+    """
+
+    def __init__(self, sink, batch_size=1000, queue_size=8):
+        self.sink = sink
+        self.records = sink.records
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.buffer = []
+        self.queue = None
+        self.thread = None
+        self.error = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(buffer=[], queue=None, thread=None)
+        return state
+
+    def open(self, sim=None):
+        self.sink.open(sim)
+        self.start()
+
+    def start(self):
+        self.buffer = []
+        self.error = None
+        self.queue = queue.Queue(self.queue_size)
+        self.thread = threading.Thread(target=self.writer, name='ThreadedSink writer', daemon=True)
+        self.thread.start()
+
+    def writer(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                self.queue.task_done()
+                return
+            if not self.error:  # keep draining so write_entry() never blocks on a dead writer
+                try:
+                    if isinstance(batch, ResultSink):
+                        self.sink.merge(batch)
+                    else:
+                        for entry in batch:
+                            self.sink.write_entry(entry)
+                    self.sink.flush()
+                except Exception as e:
+                    self.error = e
+            self.queue.task_done()
+
+    def entry(self, result, case):
+        # the snapshot is taken right away, the case's trainers may be reset before the writer gets to it
+        return self.sink.entry(result, case)
+
+    def write_entry(self, entry):
+        self.buffer.append(entry)
+        if len(self.buffer) >= self.batch_size:
+            self.queue.put(self.buffer)
+            self.buffer = []
+
+    def flush(self):
+        """Hand over buffered entries, they are written by the time close() returns"""
+        if self.buffer:
+            self.queue.put(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        if self.thread:
+            self.flush()
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.sink.close()
+        if self.error:
+            raise self.error
+
+    def checkpoint(self):
+        # wait until the writer has stored everything handed over so far
+        self.flush()
+        self.queue.join()
+        if self.error:
+            raise self.error
+        return self.sink.checkpoint()
+
+    def resume(self, sim, state):
+        self.sink.resume(sim, state)
+        self.start()
+
+    def partial(self):
+        return self.sink.partial()
+
+    def merge(self, partial):
+        # partials go through the queue too, so they are merged in order with the entries around them
+        self.flush()
+        self.queue.put(partial)
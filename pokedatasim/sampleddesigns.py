@@ -0,0 +1,177 @@
+from pokedatasim.loggable import Loggable
+import hashlib
+import random
+
+
+def keyed_hash(seed, *values):
+    """64 bit hash of a tuple of values under a seed, stable across processes and python versions"""
+    digest = hashlib.blake2b(repr(values).encode(), digest_size=8, key=str(seed).encode()[:64])
+    return int.from_bytes(digest.digest(), 'little')
+
+
+class IndexPermutation(Loggable):
+    """Pseudo-random permutation of range(n), evaluated one position at a time
+
+    A balanced Feistel network permutes the integers of the smallest even number of bits that covers n,
+    positions that land outside range(n) are permuted again until they are inside (cycle walking). No list of
+    the permuted indices is built, so n can be any python integer.
+    """
+    rounds = 4
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.seed = seed
+        self.half = (max(2, (n - 1).bit_length()) + 1) // 2
+        self.mask = (1 << self.half) - 1
+
+    def __len__(self):
+        return self.n
+
+    def encrypt(self, x):
+        left, right = x >> self.half, x & self.mask
+        for r in range(self.rounds):
+            left, right = right, left ^ (keyed_hash(self.seed, r, right) & self.mask)
+        return (left << self.half) | right
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise IndexError('permutation index out of range')
+        x = self.encrypt(i)
+        while x >= self.n:
+            x = self.encrypt(x)
+        return x
+
+
+class DesignIndices:
+    """Lazy sequence of the case indices of a sampled design, computed when they are read
+
+    positions are the k of design.case_index(k) in the sequence, all cases of the design by default.
+    Slicing slices positions, so it takes constant time and computes no case index (see skip_cases).
+    """
+
+    def __init__(self, design, positions=None):
+        self.design = design
+        self.positions = range(design.ncases) if positions is None else positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return DesignIndices(self.design, self.positions[k])
+        try:
+            return self.design.case_index(self.positions[k])
+        except IndexError:
+            raise IndexError('design index out of range') from None
+
+    def __iter__(self):
+        return map(self.design.case_index, self.positions)
+
+
+class SampledDesign(Loggable):
+    """Base class of designs that run ncases of the cases of another design (the experiment)
+
+    Like the experiment, a sampled design has an idxrange to iterate over and get_case_from_index to decode
+    its elements, which are case indices of the experiment. idxrange is a DesignIndices, so the sample is
+    never stored. Without a seed one is drawn, it is kept in self.seed so copies of the design in other
+    processes produce the same sample.
+    """
+
+    def __init__(self, experiment, ncases, seed=None):
+        self.experiment = experiment
+        self.ncases = ncases
+        self.seed = random.SystemRandom().getrandbits(64) if seed is None else seed
+        self.idxrange = DesignIndices(self)
+
+    def case_index(self, k):
+        """Case index of the experiment that is the k-th case of the design"""
+        raise NotImplementedError
+
+    def get_case_from_index(self, idx):
+        return self.experiment.get_case_from_index(idx)
+
+    def get_index_from_case(self, case):
+        return self.experiment.get_index_from_case(case)
+
+
+class RandomSample(SampledDesign):
+    """Uniform random sample of ncases different cases of the experiment, in random order"""
+
+    def __init__(self, experiment, ncases, seed=None):
+        super().__init__(experiment, ncases, seed)
+        self.start = experiment.idxrange.start
+        size = experiment.idxrange.stop - self.start
+        if ncases > size:
+            raise ValueError('cannot sample ' + str(ncases) + ' cases out of ' + str(size))
+        self.permutation = IndexPermutation(size, self.seed)
+
+    def case_index(self, k):
+        return self.start + self.permutation[k]
+
+
+class TeamDesign(SampledDesign):
+    """Base class of designs that choose the members of both teams of a FullFactPokeDataSim case separately
+
+    Every team member is a factor whose levels are the positions in the simulation's pokemon_indices, factors
+    0 to team size - 1 make up the first team. member(k, factor) picks the level of a factor for the k-th case,
+    when both teams come out the same the second team is drawn again uniformly.
+    """
+
+    def __init__(self, teams, experiment, ncases, seed=None):
+        super().__init__(experiment, ncases, seed)
+        self.teams = teams
+        self.team_size = len(teams.levels)
+        self.npokemon = teams.levels[0]
+
+    def member(self, k, factor):
+        raise NotImplementedError
+
+    def case_index(self, k):
+        members = [self.member(k, factor) for factor in range(2 * self.team_size)]
+        team1 = self.teams.get_index_from_case(members[:self.team_size])
+        team2 = self.teams.get_index_from_case(members[self.team_size:])
+        attempt = 0
+        while team1 == team2:
+            attempt += 1
+            team2 = self.teams.get_index_from_case(
+                [keyed_hash(self.seed, k, factor, attempt) % self.npokemon for factor in range(self.team_size)])
+        return self.experiment.get_index_from_case(sorted([team1, team2]))
+
+
+class StratifiedSample(TeamDesign):
+    """Sample whose team members are spread evenly over strata of the pokemon, e.g. their type or generation
+
+    strata holds a label per position in pokemon_indices. For every team member, each stratum is used for
+    ncases / (number of strata) of the cases, in random order, and the pokemon is drawn uniformly from the
+    stratum. Cases can repeat when the sample is large compared to the number of cases.
+    """
+
+    def __init__(self, teams, experiment, strata, ncases, seed=None):
+        super().__init__(teams, experiment, ncases, seed)
+        self.strata = {}
+        for position, label in enumerate(strata):
+            # missing labels (nan) do not compare equal to themselves
+            self.strata.setdefault(label if label == label else None, []).append(position)
+        self.labels = list(self.strata)
+        self.permutations = [IndexPermutation(ncases, (self.seed, factor)) for factor in range(2 * self.team_size)]
+
+    def member(self, k, factor):
+        stratum = self.strata[self.labels[self.permutations[factor][k] % len(self.labels)]]
+        return stratum[keyed_hash(self.seed, k, factor) % len(stratum)]
+
+
+class LatinHypercube(TeamDesign):
+    """Latin hypercube sample: for every team member, the ncases cases cover the pokemon evenly
+
+    The pokemon positions of a factor are split into ncases equal intervals, every case draws from a different
+    interval, matched to the cases by a random permutation per factor. With more cases than pokemon every
+    pokemon appears ncases / len(pokemon_indices) times, rounded either way, in each team slot.
+    """
+
+    def __init__(self, teams, experiment, ncases, seed=None):
+        super().__init__(teams, experiment, ncases, seed)
+        self.permutations = [IndexPermutation(ncases, (self.seed, factor)) for factor in range(2 * self.team_size)]
+
+    def member(self, k, factor):
+        interval = self.permutations[factor][k]
+        return (interval * self.npokemon + keyed_hash(self.seed, k, factor) % self.npokemon) // self.ncases
@@ -1,117 +1,560 @@
 from pokedatasim.loggable import Loggable
 import numpy as np
-from time import time
+from time import time, perf_counter
+import json
+import os
+from itertools import islice, count, takewhile
+from collections import deque
+import multiprocessing
 from tinydb import TinyDB
 from pokedatasim.trainer import Trainer
-from pokedatasim.pokemon import Pokemon
+from pokedatasim.pokemon import Pokemon, damage_calls
 from pokedatasim.dataload import *
 from pokedatasim.bigfullfactorial import BigFullFactorial
+from pokedatasim.canonicalpairs import CanonicalPairs
+from pokedatasim.pokemonarrays import PokemonArrays, load_damage_matrix
+from pokedatasim.duel import resolve_duels
+from pokedatasim.batchbattle import BattleBatch
+from pokedatasim.montecarlo import RandomBattleBatch, wilson_interval
+from pokedatasim.exactbattle import ExactBattle
+from pokedatasim.transposition import TranspositionTable
+from pokedatasim.dominance import DominanceIndex
+from pokedatasim.sampleddesigns import DesignIndices
+from pokedatasim.resultsink import ListSink
+from pokedatasim.telemetry import Telemetry
+
+
+def chunks(iterable, size):
+    """Split an iterable into lists of at most size elements"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def index_chunks(idxrange, size):
+    """Split a case index range into consecutive pieces of at most size indices, ranges are split into ranges"""
+    if isinstance(idxrange, range):
+        # len() of a range is limited to 64 bits, slicing is not
+        return takewhile(len, (idxrange[i:i + size] for i in count(0, size)))
+    return chunks(idxrange, size)
+
+
+def case_count(idxrange):
+    """Number of case indices in idxrange"""
+    if isinstance(idxrange, range):
+        # like len(), which fails on ranges of more than 2**63 indices
+        return max(0, -(-(idxrange.stop - idxrange.start) // idxrange.step))
+    return len(idxrange)
+
+
+def skip_cases(idxrange, n):
+    """The case indices of idxrange after the first n
+    ranges and the indices of sampled designs are sliced without computing the indices that are skipped"""
+    if isinstance(idxrange, (range, DesignIndices)):
+        return idxrange[n:]
+    return islice(idxrange, n, None)
+
+
+# simulation object of a worker process and the sink of the parent process, see PokeDataSimulation.run_parallel
+_worker_sim = None
+_parent_sink = None
+
+
+def _init_worker(sim):
+    global _worker_sim, _parent_sink
+    _worker_sim = sim
+    _parent_sink = sim.sink
+    if sim.seed is None:
+        # forked workers start from the parent's global random state, unseeded each needs a stream of its own
+        np.random.seed()
+
+
+def _run_chunk(idxrange):
+    _worker_sim.sink = _parent_sink.partial()
+    _worker_sim.telemetry = Telemetry()
+    pruned = _worker_sim.run_cases(idxrange)
+    _worker_sim.sink.flush()
+    return len(idxrange), pruned, _worker_sim.telemetry, _worker_sim.sink
 
 
 class PokeDataSimulation(Loggable):
-    def __init__(self, idxrange, simname=''):
-        self.results = []
+    backends = ['trainer', 'batch']
+
+    def __init__(self, idxrange, simname='', backend='trainer', batch_size=4096, seed=None, sink=None,
+                 transposition_size=0):
+        """backend selects how cases are fought: 'trainer' runs Trainer.fight one case at a time,
+        'batch' sets up batch_size cases at a time and fights them in lockstep with a BattleBatch.
+        With a seed, speed ties are broken by a random stream derived from the seed and the case index
+        (the first case index of each batch for the batch backend), so results do not depend on the order
+        or the process in which cases run.
+        Results go to sink (see resultsink), by default a ListSink that keeps them in self.results.
+        With a transposition_size, the trainer backend and exact_probabilities share resolved battle sub-states
+        between cases in self.transpositions, a TranspositionTable of at most that many entries (one per
+        process in a parallel run)."""
+        if backend not in self.backends:
+            raise ValueError('unknown backend ' + repr(backend) + ', choose from ' + str(self.backends))
+        self.sink = ListSink() if sink is None else sink
         self.idxrange = idxrange
+        self.backend = backend
+        self.batch_size = batch_size
+        self.seed = seed
+        self.transpositions = TranspositionTable(transposition_size) if transposition_size else None
+        # cases skipped because is_pruned() says their outcome is known, see run_cases
+        self.pruned = 0
+        # timers and counters of the last run, see run_simulation
+        self.telemetry = Telemetry()
         if simname == '':
             self.simname = "NewSim"
         else:
             self.simname = simname
 
+    @property
+    def results(self):
+        """Results kept in memory by the sink, None if it does not keep them"""
+        return getattr(self.sink, 'results', None)
+
+    def case_rng(self, caseidx):
+        """Random number source for case caseidx"""
+        if self.seed is None:
+            return np.random
+        return np.random.default_rng([self.seed, caseidx])
+
     def setup_case(self, caseidx):
         return {}
 
+    def setup_cases(self, block):
+        """setup_case for each case index of a list, used by the batch backend to set up a batch at once"""
+        return [self.setup_case(i) for i in block]
+
     def cleanup_case(self, case):
         pass
 
-    def run_case(self, case):
+    def run_case(self, case, rng=np.random):
         if not case:
             return None
         tic = time()
+        if self.transpositions is None:
+            case['t1win'] = case['t1'].fight(case['t2'], rng)
+        else:
+            state, turns = ExactBattle(case['t1'], case['t2'], self.transpositions).play(rng)
+            ExactBattle.apply(state, turns, case['t1'], case['t2'])
+            case['t1win'] = state[0] >= 0
+        return self.make_record(case, tic)
+
+    def run_batch(self, block):
+        """Set up and fight the cases of a list of indices in lockstep, recording and cleaning up each one afterwards
+        returns the number of pruned cases"""
+        timers = self.telemetry.timers
+        counts = self.telemetry.counts
+        tic = time()
+        start = perf_counter()
+        cases = []
+        is_pruned = [self.is_pruned(i) for i in block]
+        kept = [i for i, p in zip(block, is_pruned) if not p]
+        pruned = len(block) - len(kept)
+        for i, case in zip(kept, self.setup_cases(kept)):
+            if case:
+                case['caseidx'] = i
+                cases.append(case)
+        setup = perf_counter()
+        timers['setup_case'] += setup - start
+        counts['cases'] += len(block)
+        counts['pruned'] += pruned
+        counts['skipped'] += len(block) - pruned - len(cases)
+        if cases:
+            batch = BattleBatch.from_trainers([case['t1'] for case in cases], [case['t2'] for case in cases])
+            t1wins = batch.fight(self.case_rng(block[0]))
+            timers['fight'] += perf_counter() - setup
+            counts['battles'] += len(cases)
+            counts['turns'] += int(batch.turns.sum())
+            counts['damage_calls'] += batch.damage12.size + batch.damage21.size
+        record = cleanup = 0.0
+        # results are recorded in case index order, pruned cases between the fought ones
+        idx = 0
+        for i, p in zip(block, is_pruned):
+            t0 = perf_counter()
+            if p:
+                self.record_pruned(i)
+                record += perf_counter() - t0
+                continue
+            if idx == len(cases) or cases[idx]['caseidx'] != i:
+                # setup_case had no case for i
+                continue
+            case = cases[idx]
+            batch.apply(idx, case['t1'], case['t2'])
+            case['t1win'] = bool(t1wins[idx])
+            self.record_result(self.make_record(case, tic), case)
+            t1 = perf_counter()
+            self.cleanup_case(case)
+            record += t1 - t0
+            cleanup += perf_counter() - t1
+            idx += 1
+        timers['record_result'] += record
+        timers['cleanup_case'] += cleanup
+        return pruned
+
+    def make_record(self, case, tic):
+        """Build the result record of a case once its trainers have fought
+        returns None if the sink has no use for records"""
+        if not self.sink.records:
+            return None
         t1 = case['t1']
         t2 = case['t2']
-        t1win = t1.fight(t2)
-        if t1win:
-            record = {'Winner': t1.to_dict(), 'Loser': t2.to_dict()}
-            winner = str(t1.to_str_list())
-            loser = str(t2.to_str_list())
+        if case['t1win']:
+            winner, loser = t1, t2
         else:
-            record = {'Winner': t2.to_dict(), 'Loser': t1.to_dict()}
-            winner = str(t2.to_str_list())
-            loser = str(t1.to_str_list())
-        toc = time()
-        self.dbg(winner + ' beat ' + loser + ' in ' + str(toc-tic) + 's')
+            winner, loser = t2, t1
+        record = {'Winner': winner.to_dict(), 'Loser': loser.to_dict()}
+        if __debug__ and self.debug_enabled():
+            toc = time()
+            self.dbg('%s beat %s in %ss', winner.to_str_list(), loser.to_str_list(), toc - tic)
         return record
 
-    def record_result(self, result):
-        if result:
-            self.results.append(result)
+    def record_result(self, result, case=None):
+        """Pass a finished case to the sink, case is the dictionary from setup_case with the outcome added"""
+        if result or case:
+            self.sink.write(result, case)
 
-    def run_simulation(self):
-        tic = time()
-        self.results = []
-        for i in self.idxrange:
+    def team_tables(self):
+        """Describe the teams that take part, for sinks that store teams by index (see ColumnarSink)"""
+        return None
+
+    def is_pruned(self, caseidx):
+        """Whether the outcome of a case is known without fighting it, such cases are not fought but passed to
+        the sink by record_pruned, so sinks get every case either way"""
+        return False
+
+    def record_pruned(self, caseidx):
+        """Record a pruned case with its known outcome as if it had been fought"""
+        raise NotImplementedError
+
+    def run_cases(self, idxrange):
+        """Run and record the cases of idxrange in order, returns the number of pruned cases
+        the time spent in each phase and what happened are added to self.telemetry"""
+        pruned = 0
+        if self.backend == 'batch':
+            for block in index_chunks(idxrange, self.batch_size):
+                pruned += self.run_batch(block)
+            return pruned
+        setup = fight = record = cleanup = 0.0
+        ncases = battles = turns = skipped = 0
+        damage_start = damage_calls[0]
+        for i in idxrange:
+            ncases += 1
+            if self.is_pruned(i):
+                pruned += 1
+                t0 = perf_counter()
+                self.record_pruned(i)
+                record += perf_counter() - t0
+                continue
+            t0 = perf_counter()
             case = self.setup_case(i)
-            self.record_result(self.run_case(case))
+            if case:
+                case['caseidx'] = i
+            t1 = perf_counter()
+            result = self.run_case(case, self.case_rng(i))
+            t2 = perf_counter()
+            self.record_result(result, case)
+            t3 = perf_counter()
+            if case:
+                battles += 1
+                turns += case['t1'].turns
+            else:
+                skipped += 1
             self.cleanup_case(case)
-        toc = time()
-        telapsed = toc - tic
-        self.dbg("sim time: " + str(telapsed) + 's')
-        self.dbg("avg time per case: " + str(telapsed/(len(self.idxrange)**2)))
+            setup += t1 - t0
+            fight += t2 - t1
+            record += t3 - t2
+            cleanup += perf_counter() - t3
+        timers = self.telemetry.timers
+        timers['setup_case'] += setup
+        timers['fight'] += fight
+        timers['record_result'] += record
+        timers['cleanup_case'] += cleanup
+        counts = self.telemetry.counts
+        counts['cases'] += ncases
+        counts['battles'] += battles
+        counts['turns'] += turns
+        counts['damage_calls'] += damage_calls[0] - damage_start
+        counts['pruned'] += pruned
+        counts['skipped'] += skipped
+        return pruned
 
-    def save_results_to_tinydb(self, tinydbfname='PokeDataSim.json'):
+    def run_chunks(self, idxrange, processes, chunk_size):
+        """Run the cases of idxrange in consecutive chunks of chunk_size case indices
+        yields the number of cases in each chunk once its results have been passed to the sink"""
+        if self.backend == 'batch':
+            # keep batches aligned with a serial run so seeded results are the same
+            chunk_size = -(-chunk_size // self.batch_size) * self.batch_size
+        if processes is None or processes > 1:
+            yield from self.run_parallel(idxrange, processes, chunk_size)
+        else:
+            for chunk in index_chunks(idxrange, chunk_size):
+                self.pruned += self.run_cases(chunk)
+                yield len(chunk)
+
+    def run_parallel(self, idxrange, processes, chunk_size):
+        """Run the cases on a pool of processes, each worker gets a copy of this simulation once
+        and then runs consecutive chunks of chunk_size case indices. Results are merged in case index order,
+        the number of cases of each merged chunk is yielded.
+        At most two chunks per process are submitted and not merged yet, so a sink that is slow to merge
+        (or the consumer of this generator) holds back the workers instead of piling up finished chunks."""
+        window = 2 * (processes or os.cpu_count())
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+            pending = deque()
+            for chunk in index_chunks(idxrange, chunk_size):
+                pending.append(pool.apply_async(_run_chunk, (chunk,)))
+                if len(pending) >= window:
+                    yield self.merge_chunk(*pending.popleft().get())
+            while pending:
+                yield self.merge_chunk(*pending.popleft().get())
+
+    def merge_chunk(self, ncases, pruned, telemetry, partial):
+        """Add what a worker returned for a chunk to this simulation, returns the number of cases of the chunk"""
+        self.sink.merge(partial)
+        self.pruned += pruned
+        self.telemetry.merge(telemetry)
+        return ncases
+
+    def save_checkpoint(self, checkpoint, done):
+        """Write the number of finished cases and the sink's state to the file checkpoint
+        the file is replaced in one step, so a run killed while saving keeps the previous checkpoint"""
+        state = {'simname': self.simname, 'done': done, 'pruned': self.pruned, 'sink': self.sink.checkpoint()}
+
+        def write(fname):
+            with open(fname, 'w') as f:
+                json.dump(state, f)
+        atomic_write(checkpoint, write)
+        self.dbg('checkpoint after %s cases', done)
+
+    def run_from(self, done, processes, chunk_size, checkpoint, checkpoint_interval, progress_interval, summary):
+        self.telemetry = Telemetry(case_count(self.idxrange), done, progress_interval)
+        last_checkpoint = time()
+        try:
+            for ncases in self.run_chunks(skip_cases(self.idxrange, done), processes, chunk_size):
+                done += ncases
+                self.telemetry.progress(done)
+                if checkpoint and time() - last_checkpoint >= checkpoint_interval:
+                    self.save_checkpoint(checkpoint, done)
+                    last_checkpoint = time()
+            if checkpoint:
+                self.save_checkpoint(checkpoint, done)
+        finally:
+            self.sink.close()
+        self.telemetry.stop()
+        if self.pruned:
+            self.info('%s cases pruned', self.pruned)
+        if self.transpositions is not None:
+            self.info('transposition table: %s', self.transpositions.stats())
+        self.dbg('%s', self.telemetry.summary_message())
+        if summary:
+            extra = {'transpositions': self.transpositions.stats()} if self.transpositions is not None else {}
+            self.telemetry.save(summary, simname=self.simname, backend=self.backend, processes=processes, **extra)
+
+    def run_simulation(self, processes=1, chunk_size=4096, checkpoint=None, checkpoint_interval=60,
+                       progress_interval=None, summary=None):
+        """Run all cases, on processes worker processes if processes > 1 (None uses every core)
+
+        With a checkpoint file name, the number of finished cases is saved there every checkpoint_interval
+        seconds, at the end of a chunk and after the sink has stored the chunk's results, so an interrupted
+        run can be continued with resume_simulation.
+        Timers and counters of the run are collected in self.telemetry (see Telemetry). With a progress_interval,
+        progress and the estimated time left are logged every progress_interval seconds, with a summary file
+        name, Telemetry.summary() is written there as json at the end.
+        """
+        self.sink.open(self)
+        self.pruned = 0
+        self.run_from(0, processes, chunk_size, checkpoint, checkpoint_interval, progress_interval, summary)
+
+    def resume_simulation(self, checkpoint, processes=1, chunk_size=4096, checkpoint_interval=60,
+                          progress_interval=None, summary=None):
+        """Continue a run_simulation that saved its progress to checkpoint
+        the sink drops what was written after the checkpoint and the remaining cases are run, so with a seed
+        the final output is the same as that of an uninterrupted run. The telemetry covers the resumed part."""
+        with open(checkpoint) as f:
+            state = json.load(f)
+        if state['simname'] != self.simname:
+            raise ValueError('checkpoint ' + repr(checkpoint) + ' belongs to simulation ' + repr(state['simname']))
+        self.info('resuming %s after %s cases', self.simname, state['done'])
+        self.sink.resume(self, state['sink'])
+        self.pruned = state['pruned']
+        self.run_from(state['done'], processes, chunk_size, checkpoint, checkpoint_interval, progress_interval,
+                      summary)
+
+    def monte_carlo(self, replicates=1000, confidence=0.95, idxrange=None):
+        """Estimate the probability that t1 wins each case of idxrange (all cases by default) when attacks can be
+        critical hits and damage rolls are random
+
+        Each case is fought replicates times at once in a RandomBattleBatch with the case's random stream
+        (see case_rng), so with a seed the estimates do not depend on which cases are run.
+        Yields a dictionary per case with the case index, the teams, the number of t1 wins, the estimated
+        probability and the bounds of its Wilson score interval at the given confidence level.
+        """
+        if idxrange is None:
+            idxrange = self.idxrange
+        for i in idxrange:
+            case = self.setup_case(i)
+            if not case:
+                continue
+            batch = RandomBattleBatch.replicates(case['t1'], case['t2'], replicates)
+            wins = int(batch.fight(self.case_rng(i)).sum())
+            low, high = wilson_interval(wins, replicates, confidence)
+            self.cleanup_case(case)
+            yield {'caseidx': i, 'team1': case['team1'], 'team2': case['team2'], 'wins': wins,
+                   'replicates': replicates, 'p': wins / replicates, 'low': float(low), 'high': float(high)}
+
+    def exact_probabilities(self, idxrange=None):
+        """Exact probability that t1 wins each case of idxrange (all cases by default), see ExactBattle
+        yields a dictionary per case with the case index, the teams and the probability"""
+        if idxrange is None:
+            idxrange = self.idxrange
+        for i in idxrange:
+            case = self.setup_case(i)
+            if not case:
+                continue
+            p = ExactBattle(case['t1'], case['t2'], self.transpositions).win_probability()
+            self.cleanup_case(case)
+            yield {'caseidx': i, 'team1': case['team1'], 'team2': case['team2'], 'p': p}
+
+    def save_results_to_tinydb(self, tinydbfname='PokeDataSim.json', results=None):
+        """Store results (by default the ones kept in memory) in a TinyDB table named after the simulation"""
+        if results is None:
+            results = self.results
+        if results is None:
+            raise ValueError(type(self.sink).__name__ + ' does not keep results in memory, pass the results of '
+                             + repr(self.simname) + ' to save_results_to_tinydb')
         tic = time()
         tdb = TinyDB(tinydbfname)
         tdb.purge_table(self.simname)
         results_table = tdb.table(name=self.simname)
-        results_table.insert_multiple(self.results)
+        results_table.insert_multiple(results)
         tdb.close()
         toc = time()
-        self.dbg("db time: " + str(toc-tic) + 's')
+        self.dbg('db time: %ss', toc - tic)
 
 
 class FullFactPokeDataSim(PokeDataSimulation):
-    def __init__(self, pokemon_indices, simname="", n_pokemon_team=1):
-        experiment = BigFullFactorial([len(pokemon_indices)] * n_pokemon_team * 2)
-        super().__init__(experiment.idxrange, simname)
+    def __init__(self, pokemon_indices, simname="", n_pokemon_team=1, prune=False, **kwargs):
+        """With prune, 1v1 battles in which one pokemon dominates the other (see DominanceIndex) are not fought,
+        their known outcome is recorded instead and self.pruned counts them"""
+        if prune and n_pokemon_team != 1:
+            raise ValueError('pruning by dominance needs n_pokemon_team=1, not ' + str(n_pokemon_team))
+        # every team is a full factorial over the pokemon, cases are the pairs of different teams
+        teams = BigFullFactorial([len(pokemon_indices)] * n_pokemon_team)
+        experiment = CanonicalPairs(teams.ncases)
+        super().__init__(experiment.idxrange, simname, **kwargs)
 
-        self.pokemon_indices = pokemon_indices
-        self.index_lookup = pd.DataFrame(self.pokemon_indices, columns=["PokemonIdx"])
+        self.pokemon_indices = list(pokemon_indices)
+        self.teams = teams
         self.experiment = experiment
         self.idxrange = self.experiment.idxrange
         self.n_pokemon_team = n_pokemon_team
-        self.pokegen = Pokemon.create_pokemon_generator(load_pokemon())
+        self.prune = prune
+        self.build_tables()
+
+    @property
+    def index_lookup(self):
+        import pandas as pd
+        return pd.DataFrame(self.pokemon_indices, columns=["PokemonIdx"])
+
+    def build_tables(self):
+        self.pokemon_table = load_pokemon()
+        self.pokegen = Pokemon.create_pokemon_generator(self.pokemon_table)
+        if self.prune:
+            self.dominance = DominanceIndex.from_data_frame(self.pokemon_table.loc[self.pokemon_indices])
+
+    def __getstate__(self):
+        # workers load the pokemon table themselves, see PokeDataSimulation.run_parallel
+        state = self.__dict__.copy()
+        del state['pokemon_table']
+        del state['pokegen']
+        state.pop('dominance', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.build_tables()
 
     def setup_case(self, caseidx):
-        case = self.experiment.get_case_from_index(caseidx)
-        caset1 = case[:self.n_pokemon_team]
-        caset2 = case[self.n_pokemon_team:]
-        if np.array_equal(caset1, caset2):
-            return None  # trainer 1 == trainer 2, no point in running
-        elif self.experiment.get_index_from_case(caset2 + caset1) < caseidx:
-            return None  # Trainer 2 vs trainer 1 has already been simulated
-        else:
-            t1idx = list(self.index_lookup.loc[caset1, 'PokemonIdx'])
-            t2idx = list(self.index_lookup.loc[caset2, 'PokemonIdx'])
+        team1, team2 = self.experiment.get_case_from_index(caseidx)
+        caset1 = self.teams.get_case_from_index(team1)
+        caset2 = self.teams.get_case_from_index(team2)
+        t1idx = [self.pokemon_indices[i] for i in caset1]
+        t2idx = [self.pokemon_indices[i] for i in caset2]
+
+        return {'t1': Trainer(self.pokegen(t1idx)), 't2': Trainer(self.pokegen(t2idx)), 'team1': team1, 'team2': team2}
 
-            return {'t1': Trainer(self.pokegen(t1idx)), 't2': Trainer(self.pokegen(t2idx))}
+    def setup_cases(self, block):
+        # the members of all teams of the block are decoded at once
+        if not block:
+            return []
+        team1, team2 = zip(*(self.experiment.get_case_from_index(i) for i in block))
+        pokemon_indices = np.asarray(self.pokemon_indices)
+        # levels are positions in pokemon_indices, so the decoded cases fit in int64 even if the indices do not
+        members1 = pokemon_indices[self.teams.get_cases_from_indices(team1).astype(np.int64)].tolist()
+        members2 = pokemon_indices[self.teams.get_cases_from_indices(team2).astype(np.int64)].tolist()
+        return [{'t1': Trainer(self.pokegen(t1idx)), 't2': Trainer(self.pokegen(t2idx)), 'team1': i1, 'team2': i2}
+                for t1idx, t2idx, i1, i2 in zip(members1, members2, team1, team2)]
+
+    def set_design(self, design):
+        """Run the cases of a sampled design (see sampleddesigns) instead of all of them
+        the design's case indices are those of self.experiment"""
+        self.design = design
+        self.idxrange = design.idxrange
+
+    def is_pruned(self, caseidx):
+        # 1v1 team indices are positions in pokemon_indices
+        return self.prune and self.dominance.outcome(*self.experiment.get_case_from_index(caseidx)) is not None
+
+    def record_pruned(self, caseidx):
+        # the dominating pokemon is faster, so no speed tie is drawn and ExactBattle plays the battle out
+        # like Trainer.fight would, knocked out pokemon's last attacks included
+        case = self.setup_case(caseidx)
+        case['caseidx'] = caseidx
+        state, turns = ExactBattle(case['t1'], case['t2'], self.transpositions).play()
+        ExactBattle.apply(state, turns, case['t1'], case['t2'])
+        case['t1win'] = state[0] >= 0
+        self.record_result(self.make_record(case, time()), case)
+        self.cleanup_case(case)
+
+    def team_tables(self):
+        """Teams are not listed, a team index is decoded into positions in 'pokemon' with self.teams"""
+        return {'pokemon': [self.pokegen(i).to_dict() for i in self.pokemon_indices], 'teams': None, 'names': None,
+                'n_pokemon_team': self.n_pokemon_team, 'nteams': self.teams.ncases}
+
+    def solve_duels(self):
+        """Resolve all 1v1 battles at once without simulating them turn by turn
+        returns a matrix whose entry [i, j] is the probability that pokemon_indices[i] beats pokemon_indices[j]"""
+        if self.n_pokemon_team != 1:
+            raise ValueError('solve_duels needs n_pokemon_team=1, not ' + str(self.n_pokemon_team))
+        poketable = self.pokemon_table.loc[self.pokemon_indices]
+        arrays = PokemonArrays.from_data_frame(poketable)
+        return resolve_duels(load_damage_matrix(poketable), arrays.maxhp, arrays.speed)
 
 
 class TrainerListPokeDataSim(PokeDataSimulation):
-    def __init__(self, trainer_list, simname=""):
-        self.experiment = BigFullFactorial([len(trainer_list)] * 2)
-        super().__init__(self.experiment.idxrange, simname)
+    def __init__(self, trainer_list, simname="", **kwargs):
+        self.experiment = CanonicalPairs(len(trainer_list))
+        super().__init__(self.experiment.idxrange, simname, **kwargs)
         self.trainer_list = trainer_list
 
     def setup_case(self, caseidx):
         case = self.experiment.get_case_from_index(caseidx)
-        if case[0] == case[1]:
-            return None  # trainer 1 == trainer 2, no point in running
-        elif self.experiment.get_index_from_case([case[1], case[0]]) < caseidx:
-            return None  # Trainer 2 vs trainer 1 has already been simulated
-        else:
-            t1 = self.trainer_list[case[0]]
-            t2 = self.trainer_list[case[1]]
-            return {'t1': t1, 't2': t2}
+        t1 = self.trainer_list[case[0]]
+        t2 = self.trainer_list[case[1]]
+        return {'t1': t1, 't2': t2, 'team1': case[0], 'team2': case[1]}
+
+    def team_tables(self):
+        """Pokemon of all trainers (at full hp) with the positions of each trainer's pokemon in that list"""
+        pokemon = []
+        teams = []
+        for t in self.trainer_list:
+            teams.append(list(range(len(pokemon), len(pokemon) + len(t.pokemon))))
+            pokemon += [dict(p.to_dict(), hp=p.maxhp) for p in t.pokemon]
+        return {'pokemon': pokemon, 'teams': teams, 'names': [t.name for t in self.trainer_list],
+                'n_pokemon_team': max(len(t) for t in teams), 'nteams': len(teams)}
 
     def cleanup_case(self, case):
         if case:
@@ -0,0 +1,80 @@
+from pokedatasim.loggable import Loggable
+from time import perf_counter
+import json
+
+
+class Telemetry(Loggable):
+    """Where a simulation run spends its time, and what it did
+
+    timers holds the seconds spent in each phase of a case (see PokeDataSimulation.run_cases), counts the number
+    of cases, battles fought, turns taken, damage calculations and cases that were not fought, either pruned or
+    without a case to fight (skipped). Worker processes of a parallel run collect a Telemetry per chunk that the
+    parent merge()s, so phase times are summed over the workers and can add up to more than the elapsed time.
+    With an interval, progress() logs the fraction of total cases done, the throughput and the estimated time
+    left at most every interval seconds.
+    """
+    phases = ['setup_case', 'fight', 'record_result', 'cleanup_case']
+    counters = ['cases', 'battles', 'turns', 'damage_calls', 'pruned', 'skipped']
+
+    def __init__(self, total=None, done=0, interval=None):
+        """total is the number of cases of the run, done the number finished before it (when resuming)"""
+        self.timers = dict.fromkeys(self.phases, 0.0)
+        self.counts = dict.fromkeys(self.counters, 0)
+        self.total = total
+        self.done = done
+        self.interval = interval
+        self.started = perf_counter()
+        self.last_report = self.started
+        self.elapsed = 0.0
+
+    def merge(self, other):
+        """Add the timers and counts of another Telemetry, e.g. a worker's"""
+        for phase, seconds in other.timers.items():
+            self.timers[phase] += seconds
+        for counter, n in other.counts.items():
+            self.counts[counter] += n
+
+    def progress(self, done):
+        """Note that done cases of the run are finished, logging progress if interval seconds have passed"""
+        now = perf_counter()
+        self.elapsed = now - self.started
+        if self.interval is not None and now - self.last_report >= self.interval:
+            self.last_report = now
+            self.info('%s', self.progress_message(done))
+
+    def stop(self):
+        """Note that the run is over"""
+        self.elapsed = perf_counter() - self.started
+
+    def progress_message(self, done):
+        rate = (done - self.done) / self.elapsed if self.elapsed > 0 else 0.0
+        message = str(done) + ' cases'
+        if self.total:
+            message += ' of ' + str(self.total) + ' ({:.1%})'.format(done / self.total)
+        message += ', {:.0f} cases/s'.format(rate)
+        if self.total and rate > 0:
+            message += ', ETA {:.0f}s'.format((self.total - done) / rate)
+        return message
+
+    def summary(self):
+        """Machine readable summary of the run"""
+        per_second = lambda n: n / self.elapsed if self.elapsed > 0 else 0.0
+        phase_time = sum(self.timers.values())
+        battles = self.counts['battles']
+        return {'total': self.total, 'resumed_from': self.done, 'elapsed': self.elapsed,
+                'cases_per_second': per_second(self.counts['cases']), 'battles_per_second': per_second(battles),
+                'turns_per_battle': self.counts['turns'] / battles if battles else 0.0,
+                'counts': dict(self.counts),
+                'phases': {phase: {'seconds': seconds, 'share': seconds / phase_time if phase_time else 0.0}
+                           for phase, seconds in self.timers.items()}}
+
+    def summary_message(self):
+        summary = self.summary()
+        phases = ', '.join('{} {:.0%}'.format(phase, timer['share']) for phase, timer in summary['phases'].items())
+        return '{} cases in {:.2f}s, {:.0f} battles/s, {:.1f} turns per battle ({})'.format(
+            self.counts['cases'], self.elapsed, summary['battles_per_second'], summary['turns_per_battle'], phases)
+
+    def save(self, fname, **extra):
+        """Write summary() with the extra items added to a json file"""
+        with open(fname, 'w') as f:
+            json.dump(dict(self.summary(), **extra), f, indent=2)
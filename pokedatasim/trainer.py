@@ -1,10 +1,12 @@
 from pokedatasim.loggable import Loggable
 from pokedatasim.pokemon import Pokemon
 import numpy as np
+import sys
 
 
 class Trainer(Loggable):
     """ This class defines a Trainer """
+    __slots__ = ('pokemon', 'active_pokemon_idx', 'name', 'turns')
 
     def to_dict(self):
         dl = []
@@ -50,8 +52,10 @@ class Trainer(Loggable):
             pokemonlist = [pokemonlist]
         self.pokemon = pokemonlist
         self.active_pokemon_idx = 0
-        self.name = name
-        self.dbg(str(self))
+        self.name = sys.intern(name) if isinstance(name, str) else name
+        self.turns = 0
+        if __debug__:
+            self.dbg('%s', self)
 
     def choose_next_pokemon(self):
         """Select next pokemon, ignore types and strategy"""
@@ -60,7 +64,8 @@ class Trainer(Loggable):
             if not p.is_ko():
                 self.active_pokemon_idx = idx
                 break
-        self.dbg(str(self.active_pokemon()))
+        if __debug__:
+            self.dbg('%s', self.active_pokemon())
 
     def active_pokemon(self):
         """Return trainer's active pokemon"""
@@ -68,7 +73,8 @@ class Trainer(Loggable):
             newpokemon = self.pokemon[self.active_pokemon_idx]
             return newpokemon
         else:
-            self.dbg('No Active Pokemon')
+            if __debug__:
+                self.dbg('No Active Pokemon')
             return None
 
     def reset(self):
@@ -76,10 +82,14 @@ class Trainer(Loggable):
         for p in self.pokemon:
             p.recover()
         self.active_pokemon_idx = 0
-        self.dbg('Trainer reset')
-
-    def take_turn(self, opponent_trainer):
-        """ Process one 'turn' of pokemon battle """
+        self.turns = 0
+        if __debug__:
+            self.dbg('Trainer reset')
+
+    def take_turn(self, opponent_trainer, rng=np.random, random_damage=False):
+        """ Process one 'turn' of pokemon battle
+        rng is the random number source for speed ties, numpy's global one by default,
+        with random_damage it also draws critical hits and damage rolls (see Pokemon.calculate_damage) """
         trainers = [self, opponent_trainer]
         # Compare speed of this trainer's active pokemon and opponent's
         if self.active_pokemon().speed > opponent_trainer.active_pokemon().speed:
@@ -88,37 +98,43 @@ class Trainer(Loggable):
             order = [1, 0]
         else:
             # choose randomly
-            x = int(round(np.random.rand()))
+            x = int(round(rng.random()))
             order = [x, 1 - x]
-        if order == [0, 1]:
-            self.dbg("Initiating trainer's " + self.active_pokemon().name + " attacks first")
-        else:
-            self.dbg("Non-initiating trainer's " + opponent_trainer.active_pokemon().name + ' attacks first')
+        if __debug__:
+            if order == [0, 1]:
+                self.dbg("Initiating trainer's %s attacks first", self.active_pokemon().name)
+            else:
+                self.dbg("Non-initiating trainer's %s attacks first", opponent_trainer.active_pokemon().name)
 
         # in speed order, attack, check if there was a KO, and select next pokemon if there is
         for x in order:
             y = 1-x
-            trainers[x].active_pokemon().do_attack(trainers[y].active_pokemon())
+            trainers[x].active_pokemon().do_attack(trainers[y].active_pokemon(), rng if random_damage else None)
             if trainers[order[y]].active_pokemon().is_ko():
-                self.dbg(trainers[x].active_pokemon().name + ' knocked out ' + trainers[y].active_pokemon().name)
+                if __debug__:
+                    self.dbg('%s knocked out %s', trainers[x].active_pokemon().name, trainers[y].active_pokemon().name)
                 trainers[order[y]].choose_next_pokemon()
                 if not trainers[order[y]].active_pokemon():
                     return
                 else:
                     break
 
-    def fight(self, opponent_trainer):
+    def fight(self, opponent_trainer, rng=np.random, random_damage=False):
         """This method fights the opponent_trainer until one trainer has no conscious pokemon
-        Returns True if this trainer wins and false if they lose
+        Returns True if this trainer wins and false if they lose, self.turns counts the turns taken
+        rng and random_damage are passed on to take_turn
         """
         # while both trainers have active pokemon, take another turn
         while self.active_pokemon() and opponent_trainer.active_pokemon():
-            self.take_turn(opponent_trainer)
+            self.take_turn(opponent_trainer, rng, random_damage)
+            self.turns += 1
 
         # decide winner
         if self.active_pokemon():
-            self.dbg('Initiating trainer won')
+            if __debug__:
+                self.dbg('Initiating trainer won')
             return True
         else:
-            self.dbg('Initiating trainer lost')
+            if __debug__:
+                self.dbg('Initiating trainer lost')
             return False
@@ -0,0 +1,42 @@
+from pokedatasim.loggable import Loggable
+from collections import OrderedDict
+
+
+class TranspositionTable(Loggable):
+    """Bounded cache of resolved battle sub-states, shared by the battles of a simulation
+
+    Entries are kept in least recently used order, once there are maxsize entries the least recently used one
+    is dropped for every new one. hits, misses and evictions count what happened since the table was created.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Value stored for key, None if there is none"""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -2,10 +2,172 @@ from pokedatasim.simulation import *
 from pokedatasim.pokemon import Pokemon
 from pokedatasim.trainer import Trainer
 from pokedatasim.bigfullfactorial import BigFullFactorial
+from pokedatasim.canonicalpairs import CanonicalPairs
+from pokedatasim.resultsink import *
 from pokedatasim.dataload import *
 from pokedatasim.loggable import Loggable
+from pokedatasim.pokemonarrays import *
+from pokedatasim.montecarlo import *
+from pokedatasim.exactbattle import ExactBattle
+from pokedatasim.transposition import TranspositionTable
+from pokedatasim.dominance import DominanceIndex
+from pokedatasim.sampleddesigns import *
+from pokedatasim.ratings import *
 import numpy as np
+import pickle
+import json
+from collections import Counter
+from unittest import mock
+import importlib.util
+import multiprocessing.pool
+import threading
+import tempfile
 import unittest
+from time import sleep
+
+
+class RandomDrawSim(FullFactPokeDataSim):
+    """Records a draw from the random stream of each case and the process that drew it instead of fighting"""
+
+    def run_case(self, case, rng=np.random):
+        # slow enough that every worker of a pool gets some of the cases
+        sleep(0.002)
+        return {'draw': rng.random(), 'pid': os.getpid()}
+
+
+def load_script(path):
+    """Import a script that is not part of a package, by its path relative to the repository root"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeResponse:
+    def __init__(self, content, status=200):
+        self.content = content
+        self.status = status
+
+    def raise_for_status(self):
+        if self.status != 200:
+            raise IOError(str(self.status))
+
+
+class FakeSession:
+    """Stands in for a requests.Session serving pages, every get waits for parties gets to be in flight at once"""
+
+    def __init__(self, pages, parties=1):
+        self.pages = pages
+        self.barrier = threading.Barrier(parties, timeout=10)
+        self.lock = threading.Lock()
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        with self.lock:
+            self.urls.append(url)
+        self.barrier.wait()
+        if url not in self.pages:
+            return FakeResponse(b'', 404)
+        return FakeResponse(self.pages[url])
+
+
+class TestTrainerSpider(unittest.TestCase, Loggable):
+    """This class tests the page cache and fetcher of the bulbapedia crawler, without fetching anything"""
+
+    def setUp(self):
+        self.spider = load_script(os.path.join('bulbacrawler', 'TrainerSpider.py'))
+
+    def test_page_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = self.spider.PageCache(os.path.join(tmp, 'pages'))
+            url = 'http://example.org/wiki/Category:Trainer_classes'
+            self.assertIsNone(cache.get(url))
+            cache.put(url, b'<html>trainers</html>')
+            self.assertEqual(cache.get(url), b'<html>trainers</html>')
+            cache.put(url, b'<html>more trainers</html>')
+            # pages survive the cache object, and nothing but the page and its url is left behind
+            cache = self.spider.PageCache(os.path.join(tmp, 'pages'))
+            self.assertEqual(cache.get(url), b'<html>more trainers</html>')
+            with open(cache.path(url) + '.url') as f:
+                self.assertEqual(f.read(), url)
+            self.assertEqual(sorted(os.listdir(cache.directory)), [os.path.basename(cache.path(url)) + s
+                                                                  for s in ['', '.url']])
+
+    def test_offline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fixtures = {'http://example.org/' + str(i): ('<html>' + str(i) + '</html>').encode() for i in range(4)}
+            cache = self.spider.PageCache(tmp)
+            for url, content in fixtures.items():
+                cache.put(url, content)
+            fetcher = self.spider.Fetcher(self.spider.PageCache(tmp), workers=2, offline=True)
+            fetcher.session = mock.Mock(side_effect=AssertionError('offline fetchers must not fetch'))
+            urls = list(fixtures) + ['http://example.org/missing']
+            with self.assertLogs(level='INFO') as logs:
+                pages = fetcher.fetch_all(urls)
+            self.assertEqual(pages, list(fixtures.values()) + [None])
+            self.assertTrue(any('http://example.org/missing is not cached' in line for line in logs.output))
+            self.assertFalse(fetcher.session.called)
+
+    def test_concurrent_fetch(self):
+        pages = {'http://example.org/' + str(i): ('<html>' + str(i) + '</html>').encode() for i in range(12)}
+        urls = list(pages) + ['http://example.org/missing']
+        with tempfile.TemporaryDirectory() as tmp:
+            workers = 4
+            session = FakeSession(pages, parties=workers)
+            fetcher = self.spider.Fetcher(self.spider.PageCache(tmp), workers=workers)
+            fetcher.session = lambda: session
+            # the fake session only answers with workers gets in flight at once, fetching one at a time times out
+            fetched = fetcher.fetch_all(urls[:12])
+            self.assertEqual(fetched, list(pages.values()))
+            self.assertEqual(sorted(session.urls), sorted(urls[:12]))
+
+            # a second crawl is served by the cache, only pages that are not there yet are fetched
+            session = FakeSession(pages)
+            fetcher.session = lambda: session
+            with self.assertLogs(level='INFO') as logs:
+                fetched = fetcher.fetch_all(urls)
+            self.assertEqual(fetched, list(pages.values()) + [None])
+            self.assertEqual(session.urls, ['http://example.org/missing'])
+            self.assertTrue(any('failed to fetch http://example.org/missing' in line for line in logs.output))
+
+    @unittest.skipUnless(importlib.util.find_spec('bs4'), 'parsing pages needs bs4')
+    def test_crawl_fixtures(self):
+        fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bulbacrawler', 'fixtures')
+        base_url = 'http://bulbapedia.test'
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = self.spider.PageCache(tmp)
+            # the second category page and the Beauty page are not saved, offline they are skipped
+            for url, fname in [(self.spider.page1url, 'trainer_classes.html'),
+                               ('/wiki/Ace_Trainer_(Trainer_class)', 'ace_trainer.html')]:
+                with open(os.path.join(fixtures, fname), 'rb') as f:
+                    cache.put(base_url + url, f.read())
+            with self.assertLogs(level='INFO') as logs:
+                trainers = self.spider.crawl(self.spider.Fetcher(cache, offline=True), base_url)
+        self.assertTrue(any('Beauty_(Trainer_class) is not cached' in line for line in logs.output))
+        self.assertEqual([t.name for t in trainers], ['Red', 'Red'])
+        self.assertEqual([[(p.name, p.level) for p in t.pokemon] for t in trainers],
+                         [[('Pikachu', 81), ('Charizard', 77)], [('Venusaur', 50)]])
+
+    def test_main_keeps_trainers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, 'PokeDataSim.json')
+            tdb = TinyDB(db)
+            tdb.table('trainers').insert({'name': 'Blue', 'pokemon': []})
+            tdb.close()
+            args = ['--db', db, '--cache', os.path.join(tmp, 'pages'), '--offline']
+            # a crawl that finds nothing, like one offline with a cold cache, leaves the trainers alone
+            with mock.patch.object(self.spider, 'crawl', return_value=[]), self.assertLogs(level='INFO'):
+                self.spider.main(args)
+            tdb = TinyDB(db)
+            self.assertEqual([t['name'] for t in tdb.table('trainers').all()], ['Blue'])
+            tdb.close()
+            red = Trainer(Pokemon.from_data_frame(load_pokemon().iloc[[24]], level=81), 'Red')
+            with mock.patch.object(self.spider, 'crawl', return_value=[red]):
+                self.spider.main(args)
+            tdb = TinyDB(db)
+            self.assertEqual([t['name'] for t in tdb.table('trainers').all()], ['Red'])
+            tdb.close()
 
 
 class TestPokemonClass(unittest.TestCase, Loggable):
@@ -93,6 +255,23 @@ class TestPokemonClass(unittest.TestCase, Loggable):
         self.assertIsInstance(vcbcutgen, list)
         self.checkPokemon(vcbcutgen, checklist)
 
+    def test_pokemon_generator_cache(self):
+        poketable = load_pokemon()
+        pokegen = Pokemon.create_pokemon_generator(poketable)
+        team = pokegen([30, 30, 2])
+        self.assertEqual(len(pokegen.prototypes), 2)
+        self.assertIsNot(team[0], team[1])
+        team[0].take_damage(10)
+        self.assertEqual(team[1].hp, team[1].maxhp)
+        self.assertEqual(pokegen(30).hp, pokegen(30).maxhp)
+        for p in team + [pokegen(11, level=7)]:
+            fresh = Pokemon.from_data_frame(poketable.loc[poketable.name == p.name], level=p.level)[0]
+            self.assertTrue(p.compare(fresh))
+        self.assertEqual(len(pokegen.prototypes), 3)
+        # arrays of indices give a list like lists of indices do
+        self.assertEqual([p.name for p in pokegen(np.array([30, 2, 30]))], [p.name for p in pokegen([30, 2, 30])])
+        self.assertEqual(len(pokegen.prototypes), 3)
+
     # @unittest.skip('Skipping battle mechanics test')
     def test_battlemechanics(self):
         b = Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)
@@ -136,6 +315,30 @@ class TestPokemonClass(unittest.TestCase, Loggable):
         # squirtle attacks charmander 41
         self.assertEqual(s.do_attack(c), 41)
 
+    def test_type_codes(self):
+        table = load_type_modifier_table()
+        b = Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)
+        c = Pokemon("Charmander", "Fire", "", 39, 52, 43, 60, 50, 65)
+        self.assertEqual([Pokemon.typeNames[code] for code in b.type_codes], b.type)
+        self.assertEqual(c.defense_codes, (Pokemon.typeCodes['Fire'], Pokemon.noType))
+        # dual type multiplier matches chained lookups in the type modifier table
+        for attack in Pokemon.typeNames:
+            for defense1 in Pokemon.typeNames:
+                for defense2 in ['Grass', 'Flying']:
+                    expected = 1 * table[defense1][attack] * table[defense2][attack]
+                    code = Pokemon.typeCodes
+                    self.assertEqual(Pokemon.typeMultiplier[code[attack], code[defense1], code[defense2]], expected)
+
+    def test_compact_representation(self):
+        b = Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)
+        other = Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45, level=7)
+        t = Trainer([b, other], name='Red')
+        for obj in [b, t]:
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertIs(b.type_codes, other.type_codes)
+        self.assertEqual(Pokemon.from_dict(b.to_dict(), calcstat=False).type, ["Grass", "Poison"])
+        self.assertTrue(pickle.loads(pickle.dumps(t)).compare(t))
+
 
 class TestTrainerClass(unittest.TestCase, Loggable):
     """This class tests the Trainer class for basic functionality"""
@@ -261,6 +464,81 @@ class TestWorkerFunctions(unittest.TestCase, Loggable):
                 for idx in bff.idxrange:
                     self.assertEqual(bff.get_index_from_case(bff.get_case_from_index(idx)), idx)
 
+    def test_BigFullFactBatches(self):
+        for levels in self.samplelevels:
+            with self.subTest(i=levels):
+                bff = BigFullFactorial(levels)
+                cases = bff.get_cases_from_indices(np.arange(bff.ncases))
+                self.assertEqual(cases.tolist(), [bff.get_case_from_index(i) for i in bff.idxrange])
+                self.assertEqual(bff.get_indices_from_cases(cases).tolist(), list(bff.idxrange))
+                blocks = list(bff.iter_case_blocks(5))
+                self.assertEqual(np.concatenate([cases for indices, cases in blocks]).tolist(), cases.tolist())
+                self.assertTrue(all(len(indices) <= 5 for indices, cases in blocks))
+
+        # twelve factors with 800 levels overflow int64
+        bff = BigFullFactorial([800] * 12)
+        self.assertFalse(bff.fits_int64)
+        self.assertEqual(bff.ncases, 800 ** 12)
+        indices = [0, 2 ** 63 + 5, 800 ** 12 - 1]
+        cases = bff.get_cases_from_indices(indices)
+        self.assertEqual(cases[-1].tolist(), [799] * 12)
+        self.assertEqual(cases.tolist(), [bff.get_case_from_index(i) for i in indices])
+        self.assertEqual(bff.get_indices_from_cases(cases).tolist(), indices)
+        self.assertEqual(bff.get_index_from_case(bff.get_case_from_index(2 ** 70 + 3)), 2 ** 70 + 3)
+        self.assertIsNone(bff.get_case_from_index(800 ** 12))
+
+    def test_CanonicalPairsClass(self):
+        for nitems in [1, 2, 5, 13]:
+            with self.subTest(i=nitems):
+                pairs = CanonicalPairs(nitems)
+                bff = BigFullFactorial([nitems, nitems])
+                # same pairs in the same order as the full factorial without mirrored and repeated cases
+                expected = [case for case in map(bff.get_case_from_index, bff.idxrange) if case[0] < case[1]]
+                self.assertEqual([pairs.get_case_from_index(i) for i in pairs.idxrange], expected)
+                for idx in pairs.idxrange:
+                    self.assertEqual(pairs.get_index_from_case(pairs.get_case_from_index(idx)), idx)
+                self.assertIsNone(pairs.get_index_from_case([nitems - 1, 0]))
+                self.assertIsNone(pairs.get_case_from_index(-1))
+                self.assertIsNone(pairs.get_case_from_index(pairs.ncases))
+                # numpy indices decode like python ones
+                self.assertEqual([pairs.get_case_from_index(i) for i in np.arange(pairs.ncases)], expected)
+        # exact for design sizes beyond 64 bit integers
+        pairs = CanonicalPairs(800 ** 6)
+        for case in [[0, 1], [12345678901234, 800 ** 6 - 1], [800 ** 6 - 2, 800 ** 6 - 1]]:
+            self.assertEqual(pairs.get_case_from_index(pairs.get_index_from_case(case)), case)
+
+    def test_sampled_designs(self):
+        for n in [1, 2, 7, 1000]:
+            permutation = IndexPermutation(n, seed=3)
+            self.assertEqual(sorted(permutation[i] for i in range(n)), list(range(n)))
+        # 3v3 over 800 pokemon: far beyond 64 bits, cases are decoded on demand
+        teams = BigFullFactorial([800] * 3)
+        pairs = CanonicalPairs(teams.ncases)
+        sample = RandomSample(pairs, 500, seed=1)
+        indices = list(sample.idxrange)
+        self.assertEqual(len(set(indices)), 500)
+        self.assertEqual(sample.idxrange[7], indices[7])
+        with self.assertRaises(IndexError):
+            sample.idxrange[500]
+        # resuming skips the finished cases of a design without computing them
+        with mock.patch.object(sample, 'case_index', side_effect=AssertionError('skipped cases are computed')):
+            rest = skip_cases(sample.idxrange, 300)
+            self.assertEqual(len(rest), 200)
+        self.assertEqual(list(rest), indices[300:])
+        self.assertEqual(list(rest[50:60]), indices[350:360])
+        self.assertEqual(rest[-1], indices[-1])
+        self.assertTrue(all(i in pairs.idxrange for i in indices))
+        self.assertEqual(indices, list(RandomSample(pairs, 500, seed=1).idxrange))
+        # every pokemon fills every team slot equally often
+        lhs = LatinHypercube(teams, pairs, 1600, seed=2)
+        members = [teams.get_case_from_index(team) for i in lhs.idxrange for team in lhs.get_case_from_index(i)]
+        self.assertEqual(set(Counter(m[1] for m in members).values()), {4})
+        strata = [position % 3 for position in range(800)]
+        stratified = StratifiedSample(teams, pairs, strata, 300, seed=4)
+        members = [teams.get_case_from_index(team) for i in stratified.idxrange
+                   for team in stratified.get_case_from_index(i)]
+        self.assertEqual(Counter(strata[m[2]] for m in members), {0: 200, 1: 200, 2: 200})
+
     def test_db_loading(self):
         # test load poketable
         poketable = load_pokemon()
@@ -273,6 +551,95 @@ class TestWorkerFunctions(unittest.TestCase, Loggable):
         types = list(typemodifiertable)
         self.assertEqual(types, list(typemodifiertable.index))
 
+    def test_cached_loading(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, POKEDATASIM_CACHE=tmp):
+            fname = os.path.join(tmp, 'pokemon.csv')
+            with open(dir_path + '/pokemon.csv') as src, open(fname, 'w') as dst:
+                dst.write(src.read())
+            loaded.clear()
+            poketable = load_pokemon(fname)
+            self.assertEqual(len([f for f in os.listdir(tmp) if f.startswith('pokemon-')]), 1)
+            # callers get copies, and the disk cache gives the same table as parsing
+            poketable.loc[0, 'hp'] = 0
+            loaded.clear()
+            self.assertTrue(load_pokemon(fname).equals(load_pokemon(fname, use_cache=False)))
+            self.assertNotEqual(load_pokemon(fname).loc[0, 'hp'], 0)
+            # a changed file is parsed again
+            with open(fname, 'a') as dst:
+                dst.write('801,Testmon,Normal,,100,20,20,20,20,20,0,1,False\n')
+            self.assertEqual(len(load_pokemon(fname)), 801)
+
+            loaded.clear()
+            names, multiplier = load_type_multiplier()
+            self.assertEqual(names, Pokemon.typeNames)
+            self.assertTrue((multiplier == Pokemon.typeMultiplier).all())
+            self.assertFalse(multiplier.flags.writeable)
+        # type attributes replace themselves with their value when first read
+        Pokemon.noType
+        self.assertNotIsInstance(Pokemon.__dict__['noType'], LoadOnAccess)
+
+    def test_atomic_write(self):
+        def write(text):
+            def writer(fname):
+                with open(fname, 'w') as f:
+                    f.write(text)
+            return writer
+
+        def interrupted(fname):
+            write('partial')(fname)
+            raise KeyboardInterrupt
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'checkpoint.json')
+            atomic_write(fname, write('first'))
+            atomic_write(fname, write('second'))
+            with self.assertRaises(KeyboardInterrupt):
+                atomic_write(fname, interrupted)
+            # the file is the last complete one and no temporary files are left behind
+            self.assertEqual(os.listdir(tmp), ['checkpoint.json'])
+            with open(fname) as f:
+                self.assertEqual(f.read(), 'second')
+
+
+class TestPokemonArrays(unittest.TestCase, Loggable):
+    """This class tests the vectorized stat and damage calculations"""
+    def test_damage_matrix(self):
+        poketable = load_pokemon().iloc[::16]
+        for level in [0, 10]:
+            with self.subTest(level=level):
+                pokemonlist = Pokemon.from_data_frame(poketable, level=level)
+                arrays = PokemonArrays.from_data_frame(poketable, level=level)
+                self.assertTrue(np.array_equal(arrays.maxhp, [p.maxhp for p in pokemonlist]))
+                self.assertTrue(np.array_equal(arrays.speed, [p.speed for p in pokemonlist]))
+                expected = [[a.calculate_damage(b) for b in pokemonlist] for a in pokemonlist]
+                self.assertTrue(np.array_equal(arrays.pairwise_damage(), expected))
+
+    def test_damage_matrix_cache(self):
+        poketable = load_pokemon().iloc[:20]
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, POKEDATASIM_CACHE=tmp):
+            damage = load_damage_matrix(poketable)
+            self.assertEqual(len(os.listdir(tmp)), 1)
+            self.assertTrue(np.array_equal(load_damage_matrix(poketable), damage))
+            load_damage_matrix(poketable, level=20)
+            self.assertEqual(len(os.listdir(tmp)), 2)
+            # edited type data must not be served the matrix computed with the old one
+            multiplier = Pokemon.typeMultiplier.copy()
+            multiplier[multiplier == 2] = 4
+            with mock.patch.object(Pokemon, 'typeMultiplier', multiplier):
+                edited = load_damage_matrix(poketable)
+            self.assertEqual(len(os.listdir(tmp)), 3)
+            self.assertFalse(np.array_equal(edited, damage))
+            self.assertTrue(np.array_equal(load_damage_matrix(poketable), damage))
+
+
+class TestLoggable(unittest.TestCase, Loggable):
+    """This class tests the logging mixin"""
+    def test_lazy_debug_messages(self):
+        with self.assertLogs(level='DEBUG') as cm:
+            self.dbg('%s takes %s damage', 'Bulbasaur', 22)
+        self.assertEqual(cm.records[0].getMessage(),
+                         'TestLoggable:test_lazy_debug_messages: Bulbasaur takes 22 damage')
+
 
 # @unittest.skip('Skipping simulation Test')
 class TestSimulation(unittest.TestCase, Loggable):
@@ -285,6 +652,22 @@ class TestSimulation(unittest.TestCase, Loggable):
         self.assertEqual(pds.results[1]['Winner']['pokemon'][0]['name'], 'Venusaur')
         self.assertEqual(pds.results[2]['Winner']['pokemon'][0]['name'], 'Blastoise')
 
+    def test_solve_duels(self):
+        indices = [2, 6, 11] + list(range(100, 800, 50))
+        pds = FullFactPokeDataSim(indices)
+        winprob = pds.solve_duels()
+        # charizard beats venusaur beats blastoise beats charizard, mirror matches are a coin toss
+        self.assertEqual(winprob[1, 0], 1)
+        self.assertEqual(winprob[0, 2], 1)
+        self.assertEqual(winprob[2, 1], 1)
+        self.assertTrue(np.all(np.diag(winprob) == 0.5))
+        self.assertTrue(np.all(winprob + winprob.T == 1))
+        for i, j in zip(*np.nonzero(winprob != 0.5)):
+            with self.subTest(i=indices[i], j=indices[j]):
+                t1 = Trainer(pds.pokegen(indices[i]))
+                t2 = Trainer(pds.pokegen(indices[j]))
+                self.assertEqual(t1.fight(t2), bool(winprob[i, j]))
+
     def test_trainerlistsimresults(self):
         bs = []
         cs = []
@@ -305,5 +688,413 @@ class TestSimulation(unittest.TestCase, Loggable):
         self.assertEqual(pds.results[1]['Winner']['pokemon'][0]['name'], 'Bulbasaur')
         self.assertEqual(pds.results[2]['Winner']['pokemon'][0]['name'], 'Squirtle')
 
+    def test_batch_backend(self):
+        # venusaur, charizard, blastoise, pikachu and mewtwo have different speeds, so every battle is deterministic
+        indices = [2, 6, 11, 30, 162]
+        results = {}
+        for backend in ['trainer', 'batch']:
+            pds = FullFactPokeDataSim(indices, backend=backend, batch_size=4)
+            pds.run_simulation()
+            results[backend] = pds.results
+        self.assertEqual(len(results['batch']), 10)
+        self.assertEqual(results['batch'], results['trainer'])
+
+        # teams of different sizes and levels, again without speed ties
+        poketable = load_pokemon()
+        teams = [([2, 6, 11], 50), ([30], 60), ([162, 6], 42), ([100, 200, 300, 400, 500, 600], 45), ([11, 2], 70)]
+        for backend in ['trainer', 'batch']:
+            trainers = [Trainer(Pokemon.from_data_frame(poketable.iloc[team], level=level)) for team, level in teams]
+            speeds = [p.speed for t in trainers for p in t.pokemon]
+            self.assertEqual(len(set(speeds)), len(speeds))
+            pds = TrainerListPokeDataSim(trainers, backend=backend)
+            pds.run_simulation()
+            results[backend] = pds.results
+        self.assertEqual(len(results['batch']), 10)
+        self.assertEqual(results['batch'], results['trainer'])
+
+    def test_parallel(self):
+        # two pokemon teams drawn from the same pokemon include speed ties, seeded runs must still agree
+        for backend in ['trainer', 'batch']:
+            with self.subTest(backend=backend):
+                results = []
+                for processes in [1, 2]:
+                    pds = FullFactPokeDataSim([2, 6, 11, 30], n_pokemon_team=2, backend=backend, batch_size=16, seed=7)
+                    pds.run_simulation(processes=processes, chunk_size=20)
+                    results.append(pds.results)
+                self.assertEqual(len(results[0]), 120)
+                self.assertEqual(results[0], results[1])
+
+        bs = [Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45) for i in range(3)]
+        cs = [Pokemon("Charmander", "Fire", "", 39, 52, 43, 60, 50, 65) for i in range(3)]
+        trainers = [Trainer(bs), Trainer(cs), Trainer(bs[:1] + cs[:2]), Trainer(cs[:1] + bs[:2])]
+        results = []
+        for processes in [1, 2]:
+            pds = TrainerListPokeDataSim(trainers, seed=7)
+            pds.run_simulation(processes=processes, chunk_size=3)
+            results.append(pds.results)
+        self.assertEqual(results[0], results[1])
+
+        # unseeded workers must not share the random stream they inherit from the parent
+        pds = RandomDrawSim([2, 6, 11, 30], n_pokemon_team=2)
+        pds.run_simulation(processes=2, chunk_size=4)
+        self.assertEqual(len({result['pid'] for result in pds.results}), 2)
+        self.assertEqual(len({result['draw'] for result in pds.results}), 120)
+
+        # the parent submits a chunk when it has merged one, with at most two per process in flight
+        submitted = []
+        in_flight = []
+        apply_async = multiprocessing.pool.Pool.apply_async
+
+        def counting_apply_async(pool, *args, **kwargs):
+            submitted.append(args)
+            return apply_async(pool, *args, **kwargs)
+
+        merge = ListSink.merge
+
+        def counting_merge(sink, partial):
+            in_flight.append(len(submitted) - len(in_flight))
+            merge(sink, partial)
+
+        pds = FullFactPokeDataSim([2, 6, 11, 30], n_pokemon_team=2, seed=7)
+        with mock.patch.object(multiprocessing.pool.Pool, 'apply_async', counting_apply_async), \
+                mock.patch.object(ListSink, 'merge', counting_merge):
+            pds.run_simulation(processes=2, chunk_size=4)
+        self.assertEqual(len(pds.results), 120)
+        self.assertEqual(len(submitted), 30)
+        self.assertEqual(max(in_flight), 4)
+
+    def test_streaming_sinks(self):
+        indices = [2, 6, 11, 30]
+        pds = FullFactPokeDataSim(indices, n_pokemon_team=2, seed=1)
+        pds.run_simulation()
+        expected = pds.results
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'results.jsonl')
+            for sink, processes in [(JsonLinesSink(fname, batch_size=7), 1),
+                                    (ThreadedSink(JsonLinesSink(fname), batch_size=5, queue_size=2), 1),
+                                    (ThreadedSink(JsonLinesSink(fname)), 2)]:
+                with self.subTest(sink=type(sink).__name__, processes=processes):
+                    pds = FullFactPokeDataSim(indices, n_pokemon_team=2, seed=1, sink=sink)
+                    pds.run_simulation(processes=processes, chunk_size=11)
+                    self.assertIsNone(pds.results)
+                    self.assertEqual(list(JsonLinesSink.read(fname)), expected)
+                    with self.assertRaisesRegex(ValueError, 'does not keep results'):
+                        pds.save_results_to_tinydb(os.path.join(tmp, 'PokeDataSim.json'))
+
+    def test_columnar_sink(self):
+        poketable = load_pokemon()
+        teams = [([2, 6, 11], 50), ([30], 60), ([162, 6], 42), ([11, 2], 70)]
+        trainers = [Trainer(Pokemon.from_data_frame(poketable.iloc[team], level=level), name=str(level))
+                    for team, level in teams]
+        sims = [lambda sink: FullFactPokeDataSim([2, 6, 11], n_pokemon_team=2, seed=3, sink=sink),
+                lambda sink: TrainerListPokeDataSim(trainers, seed=3, sink=sink)]
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'results.bin')
+            for makesim in sims:
+                expected = makesim(None)
+                expected.run_simulation()
+                for processes in [1, 2]:
+                    with self.subTest(sim=type(expected).__name__, processes=processes):
+                        pds = makesim(ColumnarSink(fname, batch_size=4))
+                        pds.run_simulation(processes=processes, chunk_size=5)
+                        stored = ColumnarResults(fname)
+                        self.assertEqual(list(stored.columns['caseidx']), list(pds.idxrange))
+                        self.assertEqual(list(stored), expected.results)
+
+    def test_monte_carlo(self):
+        pds = FullFactPokeDataSim([2, 6, 11, 30], seed=2)
+        # without critical hits and with a fixed roll every replicate is the deterministic battle
+        with mock.patch.multiple(Pokemon, criticalHitRate=0, minDamageRoll=236, maxDamageRoll=236):
+            estimates = list(pds.monte_carlo(replicates=50))
+        self.assertEqual(len(estimates), 6)
+        for estimate in estimates:
+            case = pds.setup_case(estimate['caseidx'])
+            self.assertEqual(estimate['p'], float(case['t1'].fight(case['t2'])))
+        # random battles agree with Trainer.fight(random_damage=True) within the confidence interval
+        estimate, = pds.monte_carlo(replicates=2000, idxrange=[5])
+        self.assertEqual(estimate, next(pds.monte_carlo(replicates=2000, idxrange=[5])))
+        case = pds.setup_case(5)
+        rng = np.random.default_rng(0)
+        wins = 0
+        for i in range(2000):
+            case['t1'].reset()
+            case['t2'].reset()
+            wins += case['t1'].fight(case['t2'], rng, random_damage=True)
+        self.assertTrue(0 < estimate['p'] < 1)
+        self.assertTrue(estimate['low'] <= wins / 2000 <= estimate['high'])
+        self.assertAlmostEqual(wilson_interval(0, 10)[0], 0)
+
+    def test_exact_probabilities(self):
+        # 1v1 with speed ties agrees with the closed form
+        indices = [6, 30, 32, 47, 49, 57]
+        arrays = PokemonArrays.from_data_frame(load_pokemon().loc[indices])
+        self.assertGreater(len(set(arrays.speed)), 1)
+        self.assertLess(len(set(arrays.speed)), len(indices))
+        expected = resolve_duels(arrays.pairwise_damage(), arrays.maxhp, arrays.speed)
+        pds = FullFactPokeDataSim(indices)
+        for result in pds.exact_probabilities():
+            i, j = pds.experiment.get_case_from_index(result['caseidx'])
+            self.assertEqual(result['p'], expected[i, j])
+        # mirror teams branch on ties at several points, each state is resolved once
+        pokegen = Pokemon.create_pokemon_generator(load_pokemon())
+        battle = ExactBattle(Trainer(pokegen([6, 6, 6])), Trainer(pokegen([6, 6, 6])))
+        self.assertEqual(battle.win_probability(), 0.71875)
+        self.assertEqual(len(battle.memo), 83)
+
+    def test_transposition_table(self):
+        table = TranspositionTable(maxsize=2)
+        table.put('a', 1)
+        table.put('b', 2)
+        self.assertEqual(table.get('a'), 1)
+        table.put('c', 3)
+        self.assertIsNone(table.get('b'))
+        self.assertEqual(table.stats(), {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1, 'evictions': 1,
+                                         'hit_rate': 0.5})
+        # shared sub-states give the same results as fighting every case from scratch
+        indices = [2, 6, 11, 6]
+        expected = FullFactPokeDataSim(indices, n_pokemon_team=3, seed=4)
+        expected.run_simulation()
+        exact = [r['p'] for r in expected.exact_probabilities()]
+        for size in [50, 10000]:
+            with self.subTest(size=size):
+                pds = FullFactPokeDataSim(indices, n_pokemon_team=3, seed=4, transposition_size=size)
+                pds.run_simulation()
+                self.assertEqual(pds.results, expected.results)
+                self.assertEqual([r['p'] for r in pds.exact_probabilities()], exact)
+                self.assertGreater(pds.transpositions.hits, 0)
+                self.assertLessEqual(len(pds.transpositions), size)
+
+    def test_dominance_pruning(self):
+        poketable = load_pokemon().iloc[:120]
+        index = DominanceIndex.from_data_frame(poketable)
+        pokemon = Pokemon.from_data_frame(poketable)
+        expected = {(i, j) for i, p in enumerate(pokemon) for j, q in enumerate(pokemon)
+                    if p.deterministically_inferior_to(q)}
+        self.assertEqual(index.inferior, expected)
+        # dominated 1v1 cases are not fought, but their outcome is recorded like that of a fought case
+        indices = [0, 1, 2, 4, 6, 9, 10, 11, 17, 18]
+        full = FullFactPokeDataSim(indices)
+        full.run_simulation()
+        for backend, processes in [('trainer', 1), ('batch', 1), ('trainer', 2)]:
+            with self.subTest(backend=backend, processes=processes):
+                pds = FullFactPokeDataSim(indices, prune=True, backend=backend)
+                pds.run_simulation(processes=processes, chunk_size=10)
+                self.assertGreater(pds.pruned, 0)
+                self.assertEqual(pds.pruned, len(pds.dominance))
+                self.assertEqual(pds.results, full.results)
+        # sinks that count wins see the pruned cases too
+        sinks = [WinMatrixSink(), WinMatrixSink()]
+        for prune, sink in zip([False, True], sinks):
+            FullFactPokeDataSim(indices, prune=prune, sink=sink, backend='batch').run_simulation()
+        self.assertTrue((sinks[0].wins == sinks[1].wins).all())
+        with self.assertRaises(ValueError):
+            FullFactPokeDataSim(indices, n_pokemon_team=2, prune=True)
+
+    def test_sampled_simulation(self):
+        def run(backend, processes):
+            pds = FullFactPokeDataSim(list(range(40)), n_pokemon_team=2, seed=6, backend=backend, batch_size=8)
+            pds.set_design(LatinHypercube(pds.teams, pds.experiment, 30, seed=6))
+            pds.run_simulation(processes=processes, chunk_size=8)
+            return pds
+
+        pds = run('trainer', 1)
+        expected = []
+        for i in pds.idxrange:
+            case = pds.setup_case(i)
+            case['t1win'] = case['t1'].fight(case['t2'], pds.case_rng(i))
+            expected.append(pds.make_record(case, 0))
+        self.assertEqual(pds.results, expected)
+        for backend in PokeDataSimulation.backends:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(backend, 2).results, run(backend, 1).results)
+
+    def test_checkpoint_resume(self):
+        indices = [2, 6, 11, 30]
+        expected = {}
+        for backend in PokeDataSimulation.backends:
+            pds = FullFactPokeDataSim(indices, n_pokemon_team=2, seed=1, backend=backend, batch_size=4)
+            pds.run_simulation()
+            expected[backend] = pds.results
+
+        def interrupted_setup(caseidx):
+            if caseidx == 40:
+                raise KeyboardInterrupt
+            return FullFactPokeDataSim.setup_case(pds, caseidx)
+
+        def interrupted_setup_cases(block):
+            if 40 in block:
+                raise KeyboardInterrupt
+            return FullFactPokeDataSim.setup_cases(pds, block)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, 'checkpoint.json')
+            jsonl = os.path.join(tmp, 'results.jsonl')
+            columnar = os.path.join(tmp, 'results.bin')
+            sqlite = os.path.join(tmp, 'results.sqlite')
+            read_jsonl = lambda: list(JsonLinesSink.read(jsonl))
+            read_columnar = lambda: list(ColumnarResults(columnar))
+            read_sqlite = lambda: list(SqliteResults(sqlite, 'NewSim'))
+            for sink, read, backend in [(JsonLinesSink(jsonl, batch_size=4), read_jsonl, 'trainer'),
+                                        (ThreadedSink(JsonLinesSink(jsonl)), read_jsonl, 'batch'),
+                                        (ColumnarSink(columnar, batch_size=4), read_columnar, 'batch'),
+                                        (SqliteSink(sqlite, batch_size=4), read_sqlite, 'trainer')]:
+                with self.subTest(sink=type(sink).__name__, backend=backend):
+                    pds = FullFactPokeDataSim(indices, n_pokemon_team=2, seed=1, sink=sink, backend=backend,
+                                              batch_size=4)
+                    pds.setup_case = interrupted_setup
+                    pds.setup_cases = interrupted_setup_cases
+                    with self.assertRaises(KeyboardInterrupt):
+                        pds.run_simulation(chunk_size=6, checkpoint=checkpoint, checkpoint_interval=0)
+                    with open(checkpoint) as f:
+                        self.assertEqual(json.load(f)['done'], 36 if backend == 'trainer' else 40)
+                    del pds.setup_case, pds.setup_cases
+                    pds.resume_simulation(checkpoint, chunk_size=6, checkpoint_interval=0)
+                    self.assertEqual(read(), expected[backend])
+
+    def test_sqlite_sink(self):
+        indices = [2, 6, 11, 30]
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'results.sqlite')
+            for n_pokemon_team, processes, threaded in [(1, 1, False), (2, 1, False), (2, 2, False), (2, 1, True)]:
+                with self.subTest(n_pokemon_team=n_pokemon_team, processes=processes, threaded=threaded):
+                    expected = FullFactPokeDataSim(indices, 'sqlite', n_pokemon_team, seed=4)
+                    expected.run_simulation()
+                    sink = SqliteSink(fname, batch_size=7)
+                    if threaded:
+                        sink = ThreadedSink(sink, batch_size=5)
+                    pds = FullFactPokeDataSim(indices, 'sqlite', n_pokemon_team, seed=4, sink=sink)
+                    pds.run_simulation(processes=processes, chunk_size=10)
+                    results = SqliteResults(fname, 'sqlite')
+                    self.assertEqual(len(results), len(expected.results))
+                    self.assertEqual(list(results), expected.results)
+                    for side, query in [('Winner', results.wins), ('Loser', results.losses)]:
+                        battles = [r for r in expected.results
+                                   if 'Charizard' in [p['name'] for p in r[side]['pokemon']]]
+                        self.assertEqual(len(query('Charizard')), len(battles))
+                    results.close()
+
+            # several simulations share a database
+            trainers = [Trainer([Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)], name='Erika'),
+                        Trainer([Pokemon("Charmander", "Fire", "", 39, 52, 43, 60, 50, 65)], name='Blaine')]
+            TrainerListPokeDataSim(trainers, 'gyms', sink=SqliteSink(fname)).run_simulation()
+            results = SqliteResults(fname, 'gyms')
+            self.assertEqual([r['Winner']['name'] for r in results], ['Blaine'])
+            self.assertEqual(len(SqliteResults(fname, 'sqlite')), len(expected.results))
+            with self.assertRaises(KeyError):
+                SqliteResults(fname, 'missing')
+            indexes = {row[0] for row in results.db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            self.assertTrue({'battles_winner', 'battles_loser', 'pokemon_name'} <= indexes)
+            self.assertEqual(results.db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            results.close()
+
+    def test_win_matrix(self):
+        indices = [2, 6, 11, 30, 64, 93, 130, 149]
+        full = FullFactPokeDataSim(indices, seed=2)
+        full.run_simulation()
+        names = [full.pokegen(i).name for i in indices]
+        expected = np.zeros((len(indices), len(indices)), dtype=np.int64)
+        for r in full.results:
+            expected[names.index(r['Winner']['pokemon'][0]['name']), names.index(r['Loser']['pokemon'][0]['name'])] += 1
+        for sink, processes in [(WinMatrixSink(batch_size=5), 1), (ThreadedSink(WinMatrixSink()), 1),
+                                (WinMatrixSink(), 2)]:
+            with self.subTest(sink=type(sink).__name__, processes=processes):
+                pds = FullFactPokeDataSim(indices, seed=2, sink=sink)
+                pds.run_simulation(processes=processes, chunk_size=7)
+                self.assertIsNone(pds.results)
+                wins = getattr(sink, 'sink', sink).wins
+                self.assertTrue((wins == expected).all())
+
+        # shards of the cases add up to the whole run
+        with tempfile.TemporaryDirectory() as tmp:
+            shards = []
+            for k, idxrange in enumerate([full.idxrange[:10], full.idxrange[10:]]):
+                pds = FullFactPokeDataSim(indices, seed=2, sink=WinMatrixSink(os.path.join(tmp, str(k) + '.npz')))
+                pds.idxrange = idxrange
+                pds.run_simulation()
+                shards.append(WinMatrixSink.load(pds.sink.fname))
+            shards[0].merge(shards[1])
+            self.assertTrue((shards[0].wins == expected).all())
+            self.assertTrue((shards[0].losses == expected.T).all())
+            rate = shards[0].win_rate()
+            self.assertTrue(np.allclose((rate + rate.T)[~np.eye(len(indices), dtype=bool)], 1))
+
+        pds = FullFactPokeDataSim([2, 6, 11], n_pokemon_team=2, sink=WinMatrixSink(), backend='batch')
+        pds.run_simulation()
+        self.assertEqual(pds.sink.wins.shape, (9, 9))
+        self.assertEqual(pds.sink.wins.sum(), len(pds.idxrange))
+        with self.assertRaises(ValueError):
+            FullFactPokeDataSim([2, 6, 11], n_pokemon_team=3, sink=WinMatrixSink(max_teams=20)).run_simulation()
+
+    def test_ratings(self):
+        indices = list(range(12))
+        plain = FullFactPokeDataSim(indices, seed=3)
+        plain.run_simulation()
+        for processes in [1, 2]:
+            with self.subTest(processes=processes):
+                records, elo, matrix = ListSink(), EloSink(), WinMatrixSink()
+                pds = FullFactPokeDataSim(indices, seed=3, sink=TeeSink(records, elo, matrix))
+                pds.run_simulation(processes=processes, chunk_size=7)
+                self.assertEqual(records.results, plain.results)
+                if processes == 1:
+                    serial = elo.ratings
+                self.assertEqual(elo.ratings, serial)
+        names = [pds.pokegen(i).name for i in indices]
+        board = elo.pokemon_leaderboard()
+        self.assertEqual([row['wins'] for row in board],
+                         [int(matrix.wins[names.index(row['name'])].sum()) for row in board])
+        self.assertTrue(all(row['games'] == len(indices) - 1 for row in board))
+        self.assertEqual(board[0]['wins'], matrix.wins.sum(axis=1).max())
+        self.assertAlmostEqual(sum(row['rating'] for row in board), 1500 * len(indices))
+        bt = bradley_terry_ratings(matrix.wins)
+        self.assertEqual(np.argsort(bt)[-1], matrix.wins.sum(axis=1).argmax())
+        # resuming from a checkpoint that went through json gives the same ratings
+        resumed = EloSink()
+        resumed.resume(pds, json.loads(json.dumps(elo.checkpoint())))
+        self.assertEqual(resumed.team_leaderboard(), elo.team_leaderboard())
+
+        # Bradley-Terry recovers the strengths that generated a win matrix
+        rng = np.random.default_rng(0)
+        strength = rng.normal(size=20)
+        games = rng.binomial(500, 1 / (1 + np.exp(strength[None, :] - strength[:, None])))
+        wins = np.triu(games, 1) + np.tril(500 - games.T, -1)
+        fitted = np.log(bradley_terry(wins, prior=0))
+        self.assertLess(np.abs(fitted - strength + strength.mean()).max(), 0.1)
+
+        trainers = [Trainer([Pokemon("Bulbasaur", "Grass", "Poison", 45, 49, 49, 65, 65, 45)], name='Erika'),
+                    Trainer([Pokemon("Charmander", "Fire", "", 39, 52, 43, 60, 50, 65)], name='Blaine'),
+                    Trainer([Pokemon('Squirtle', 'Water', '', 44, 48, 65, 50, 64, 43)], name='Misty')]
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'leaderboard.json')
+            TrainerListPokeDataSim(trainers, sink=EloSink(fname)).run_simulation()
+            with open(fname) as f:
+                teams = json.load(f)['teams']
+        self.assertEqual(sorted(row['name'] for row in teams), ['Blaine', 'Erika', 'Misty'])
+        self.assertEqual([row['wins'] for row in teams], [1, 1, 1])
+
+    def test_telemetry(self):
+        indices = [0, 1, 2, 4, 6, 9, 10, 11, 17, 18]
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend, processes in [('trainer', 1), ('batch', 1), ('trainer', 2)]:
+                with self.subTest(backend=backend, processes=processes):
+                    summary = os.path.join(tmp, backend + str(processes) + '.json')
+                    pds = FullFactPokeDataSim(indices, prune=True, backend=backend, batch_size=8)
+                    with self.assertLogs(level='INFO') as logs:
+                        pds.run_simulation(processes=processes, chunk_size=16, progress_interval=0, summary=summary)
+                    self.assertTrue(any('45 cases of 45 (100.0%)' in line for line in logs.output))
+                    with open(summary) as f:
+                        summary = json.load(f)
+                    counts = summary['counts']
+                    self.assertEqual(counts['cases'], 45)
+                    self.assertEqual(counts['pruned'], pds.pruned)
+                    self.assertEqual(counts['battles'], 45 - pds.pruned)
+                    self.assertGreaterEqual(counts['turns'], counts['battles'])
+                    # a 1v1 battle calculates damage for both pokemon, once per attack or once up front
+                    self.assertGreaterEqual(counts['damage_calls'], 2 * counts['battles'])
+                    self.assertEqual(summary['total'], 45)
+                    self.assertEqual(summary['backend'], backend)
+                    self.assertAlmostEqual(sum(phase['share'] for phase in summary['phases'].values()), 1)
+                    self.assertGreater(summary['phases']['fight']['seconds'], 0)
+
+
 if __name__ == "__main__":
     unittest.main()